@@ -1,5 +1,11 @@
+import os
+import shutil
+import tempfile
+import logging
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 class Config:
     BASE_DIR = Path("processed_data")
     VIDEO_DIR = BASE_DIR / "video"
@@ -7,4 +13,49 @@ class Config:
     GIF_DIR = BASE_DIR / "gifs"
     INDEX_PATH = BASE_DIR / "video_index"
     MAX_WORKERS = 4
-    SUPPORTED_FORMATS = ['.mp4', '.avi', '.mov', '.mkv']
\ No newline at end of file
+    SUPPORTED_FORMATS = ['.mp4', '.avi', '.mov', '.mkv']
+    # Промежуточные клипы и аудио можно держать в tmpfs (RAM-диск)
+    USE_RAMDISK = os.environ.get("VIDEO_RAG_USE_RAMDISK", "0") == "1"
+    RAMDISK_DIR = Path(os.environ.get("VIDEO_RAG_TMPFS", "/dev/shm/video_rag"))
+    # Запас места на RAM-диске: число клипов × ожидаемый размер клипа
+    RAMDISK_CLIP_BUDGET = 120
+    EXPECTED_CLIP_SIZE = 5 * 1024 * 1024
+    # Аппаратное кодирование клипов (NVENC/QSV/VideoToolbox/VAAPI), если доступно
+    USE_HW_ENCODER = os.environ.get("VIDEO_RAG_HW_ENCODER", "1") == "1"
+    # GIF-превью временные (удаляются через 24 часа) и по умолчанию пишутся в tmpfs,
+    # откуда их отдает Gradio; без /dev/shm используется системный временный каталог
+    GIF_TMP_DIR = Path(os.environ.get(
+        "VIDEO_RAG_GIF_DIR",
+        "/dev/shm/video-rag/gifs" if os.path.isdir("/dev/shm")
+        else os.path.join(tempfile.gettempdir(), "video-rag", "gifs")
+    ))
+    # Число одновременных проходов модели ImageBind (модель общая для всех потоков)
+    EXTRACTION_WORKERS = int(os.environ.get("VIDEO_RAG_EXTRACTION_WORKERS", "2"))
+    # Потоки декодирования пакетов клипов; модель при этом занята не более EXTRACTION_WORKERS из них
+    DECODE_WORKERS = int(os.environ.get("VIDEO_RAG_DECODE_WORKERS", str(min(os.cpu_count() or 1, 4))))
+    # Число клипов в одном проходе модели ImageBind
+    EXTRACTION_BATCH_SIZE = int(os.environ.get("VIDEO_RAG_EXTRACTION_BATCH", "4"))
+    # int8-веса ImageBind: динамическое квантование на CPU и bitsandbytes на GPU.
+    # Эмбеддинги int8-модели немного отличаются от FP32: режим не меняют для уже построенного индекса
+    CPU_INT8 = os.environ.get("VIDEO_RAG_CPU_INT8", "0") == "1"
+    CUDA_INT8 = os.environ.get("VIDEO_RAG_CUDA_INT8", "0") == "1"
+    # Индекс сохраняется на диск раз в столько обработанных видео (и при завершении приложения)
+    INDEX_SAVE_EVERY = max(1, int(os.environ.get("VIDEO_RAG_INDEX_SAVE_EVERY", "5")))
+
+def resolve_work_dir(base_dir: Path, required_bytes: int) -> Path:
+    """Каталог для промежуточных файлов: RAM-диск, если он включен и на нем хватает места"""
+    if not Config.USE_RAMDISK:
+        return base_dir
+    
+    try:
+        Config.RAMDISK_DIR.mkdir(parents=True, exist_ok=True)
+        free_bytes = shutil.disk_usage(Config.RAMDISK_DIR).free
+    except OSError as e:
+        logger.warning(f"RAM-диск {Config.RAMDISK_DIR} недоступен, используется {base_dir}: {e}")
+        return base_dir
+    
+    if free_bytes < required_bytes:
+        logger.warning(f"Недостаточно места на RAM-диске ({free_bytes / (1024 * 1024):.0f} МБ), используется {base_dir}")
+        return base_dir
+    
+    return Config.RAMDISK_DIR
@@ -1,17 +1,96 @@
 import os
-os.environ['MallocStackLogging'] = '1'
+# Запись стеков malloc (macOS) многократно замедляет аллокатор процесса и дочерних FFmpeg,
+# поэтому включается только явно для отладки памяти
+if os.getenv("VIDEO_RAG_DEBUG_MALLOC"):
+    os.environ['MallocStackLogging'] = '1'
 import av
 import numpy as np
 import subprocess
-from typing import List, Tuple
+import csv
+import hashlib
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 from pathlib import Path
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import multiprocessing
+import threading
+from functools import lru_cache
+
+from ..config import Config, resolve_work_dir
+from ..utils.pool import get_pool
+from ..utils.subprocess_runner import AsyncSubprocessRunner, FFMPEG_CMD
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+VAAPI_DEVICE = '/dev/dri/renderD128'
+# Порядок предпочтения аппаратных кодировщиков H.264
+HW_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'h264_vaapi')
+
+@lru_cache(maxsize=1)
+def _detect_hw_encoder() -> Optional[str]:
+    # Кодировщик может быть собран в FFmpeg, но не иметь устройства,
+    # поэтому каждый кандидат проверяется коротким тестовым кодированием
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+            text=True, timeout=10, close_fds=False
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Не удалось получить список кодировщиков FFmpeg: {e}")
+        return None
+    
+    for encoder in HW_ENCODERS:
+        if encoder not in result.stdout:
+            continue
+        
+        test_cmd = ['ffmpeg', '-v', 'error']
+        if encoder == 'h264_vaapi':
+            test_cmd += ['-vaapi_device', VAAPI_DEVICE]
+        test_cmd += ['-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1']
+        if encoder == 'h264_vaapi':
+            test_cmd += ['-vf', 'format=nv12,hwupload']
+        test_cmd += ['-c:v', encoder, '-f', 'null', '-']
+        
+        try:
+            probe = subprocess.run(
+                test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                timeout=10, close_fds=False
+            )
+        except subprocess.TimeoutExpired:
+            continue
+        if probe.returncode == 0:
+            logger.info(f"Найден аппаратный кодировщик: {encoder}")
+            return encoder
+    
+    return None
+
+@lru_cache(maxsize=256)
+def _probe(video_path: str, mtime_ns: int, size: int) -> dict:
+    # mtime и размер входят в ключ кэша: измененный файл будет прочитан заново
+    with av.open(video_path) as container:
+        video_stream = next(s for s in container.streams if s.type == 'video')
+        # container.duration - целое число в av.time_base (микросекундах), без арифметики Fraction;
+        # длительность потока - запасной вариант для контейнеров без глобальной длительности
+        if container.duration:
+            duration = container.duration / av.time_base
+        else:
+            duration = float(video_stream.duration * video_stream.time_base)
+        codec_context = video_stream.codec_context
+        fps = float(video_stream.average_rate) if video_stream.average_rate else 0.0
+        # Наличие аудио проверяем по уже открытому контейнеру, без отдельного ffprobe
+        has_audio = any(s.type == 'audio' for s in container.streams)
+        
+        return {
+            'duration': duration,
+            'has_audio': has_audio,
+            'codec_name': codec_context.name,
+            'width': codec_context.width,
+            'height': codec_context.height,
+            'pix_fmt': codec_context.pix_fmt,
+            'fps': fps
+        }
+
 class VideoProcessor:
     '''
     Класс VideoProcessor отвечает за обработку видеофайлов: разделение на клипы, 
@@ -21,184 +100,393 @@ class VideoProcessor:
         # Инициализация базовых директорий для хранения обработанных данных
         # max_workers ограничивает количество параллельных процессов
         self.base_dir = base_dir
-        self.video_dir = base_dir / "video"
-        self.audio_dir = base_dir / "audio"
+        work_dir = resolve_work_dir(base_dir, Config.RAMDISK_CLIP_BUDGET * Config.EXPECTED_CLIP_SIZE)
+        self.video_dir = work_dir / "video"
+        self.audio_dir = work_dir / "audio"
         
         self.video_dir.mkdir(parents=True, exist_ok=True)
         self.audio_dir.mkdir(parents=True, exist_ok=True)
+        # Пути клипов собираются конкатенацией строк, без создания объектов Path на каждый клип
+        self._video_dir_str = str(self.video_dir) + os.sep
+        self._audio_dir_str = str(self.audio_dir) + os.sep
         
         self.target_resolution = (640, 360)
+        self.clip_duration = 30.0
         # Используем количество CPU ядер, но не больше 8 для контроля ресурсов
         self.max_workers = max_workers or min(multiprocessing.cpu_count(), 8)
-        logger.info(f"Инициализация VideoProcessor в {base_dir}, workers: {self.max_workers}")
+        # Потоки FFmpeg делятся между процессами, чтобы суммарно их было ~ числу ядер
+        self.ffmpeg_threads = max(1, multiprocessing.cpu_count() // self.max_workers)
+        self.hw_encoder = _detect_hw_encoder() if Config.USE_HW_ENCODER else None
+        self.runner = AsyncSubprocessRunner(self.max_workers)
+        # Лимит одновременных нарезок общий для всех вызовов: фоновые задачи интерфейса идут
+        # в разных потоках со своими event loop, и asyncio.Semaphore на вызов его не ограничивал
+        self._ffmpeg_slots = threading.BoundedSemaphore(self.max_workers)
+        logger.info(f"Инициализация VideoProcessor в {base_dir}, workers: {self.max_workers}, "
+                    f"кодировщик: {self.hw_encoder or 'libx264'}")
 
-    def process_video(self, video_path: str) -> List[Tuple[str, str]]:
+    def process_video(self, video_path: str, clip_id: str = None) -> Iterator[Tuple[str, str]]:
         # Основной метод обработки видео
-        # 1. Получает информацию о видео (длительность, наличие аудио)
-        # 2. Разделяет на клипы по 30 секунд
-        # 3. Обрабатывает клипы параллельно для ускорения
-        # Возвращает список кортежей (путь_к_видео_клипу, путь_к_аудио_клипу)
+        # 1. Получает информацию о видео (длительность, наличие аудио, кодек)
+        # 2. Разрезает видео на клипы по 30 секунд одним вызовом FFmpeg (segment muxer)
+        # 3. Параллельно вторым процессом так же нарезает аудио
+        # 4. Переименовывает сегменты в формат {имя}_{id}_{начало}_{конец}
+        # clip_id - идентификатор содержимого видео (по умолчанию - хэш пути).
+        # Генерирует кортежи (путь_к_видео_клипу, путь_к_аудио_клипу) по мере готовности
+        # сегментов, чтобы вызывающий код мог обрабатывать первые клипы, пока режутся следующие
+        loop = asyncio.new_event_loop()
+        clips = self._iter_clips_async(video_path, clip_id)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(clips.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(clips.aclose())
+            loop.close()
+
+    async def _process_video_async(self, video_path: str) -> List[Tuple[str, str]]:
+        # Для пакетной обработки ошибка одного видео - пустой список клипов (уже залогирована)
+        try:
+            return [clip async for clip in self._iter_clips_async(video_path)]
+        except Exception:
+            return []
+
+    async def _acquire_ffmpeg_slot(self) -> None:
+        # Семафор threading общий для всех потоков и их event loop; блокирующее ожидание идет
+        # в потоке исполнителя, и цикл событий не занят опросом
+        future = asyncio.get_running_loop().run_in_executor(None, self._ffmpeg_slots.acquire)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Слот, полученный уже после отмены ожидания, сразу возвращается
+            future.add_done_callback(lambda f: f.cancelled() or self._ffmpeg_slots.release())
+            raise
+
+    async def _release_ffmpeg_slot(self, processes: List[asyncio.subprocess.Process]) -> None:
+        try:
+            for process in processes:
+                await process.wait()
+        finally:
+            self._ffmpeg_slots.release()
+
+    async def _iter_clips_async(self, video_path: str, clip_id: str = None) -> AsyncIterator[Tuple[str, str]]:
+        processes = []
+        slot_release = None
         try:
             logger.info(f"Обработка видео: {video_path}")
             
             # Получаем информацию о видео один раз
-            video_info = self._get_video_info(video_path)
+            # Пробинг выполняется в общем пуле потоков: у каждого нового event loop
+            # иначе создавался бы собственный пул по умолчанию
+            video_info = await asyncio.get_running_loop().run_in_executor(
+                get_pool(), self._get_video_info, video_path
+            )
             duration = video_info['duration']
             has_audio = video_info['has_audio']
             
-            clip_duration = 30.0
-            logger.info(f"Длительность видео: {duration:.2f}с, разделение на {duration/clip_duration:.1f} клипов")
+            clip_duration = self.clip_duration
+            # Точные границы клипов в секундах, включая неполный последний клип
+            starts = np.arange(0.0, duration, clip_duration)
+            ends = np.minimum(starts + clip_duration, duration)
+            clip_bounds = list(zip(starts.tolist(), ends.tolist()))
+            logger.info(f"Длительность видео: {duration:.2f}с, разделение на {len(clip_bounds)} клипов")
             
-            # Создаем список задач для параллельной обработки
-            clip_tasks = []
-            for start in range(0, int(duration), int(clip_duration)):
-                end = min(start + clip_duration, duration)
-                clip_tasks.append((video_path, start, end, has_audio))
+            stem = self._clip_stem(video_path, clip_id)
+            # '%' в пути экранируется: шаблон номеров сегментов разбирают и FFmpeg, и оператор %
+            video_pattern = (self._video_dir_str + stem).replace('%', '%%') + "_seg_%03d.mp4"
+            audio_pattern = (self._audio_dir_str + stem).replace('%', '%%') + "_seg_%03d.wav"
+            self._remove_stale_segments(stem)
             
-            # Обрабатываем клипы параллельно
-            clips_info = []
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                results = executor.map(self._create_clip_parallel, clip_tasks)
-                clips_info = list(results)
+            # Список сегментов FFmpeg пишет в stdout: строка появляется, когда сегмент закрыт
+            # Границы клипов передаются FFmpeg явно: весь исходник декодируется одним проходом
+            split_points = starts[1:].tolist()
+            video_cmd = self._build_video_segment_cmd(
+                video_path, video_info, split_points, video_pattern, 'pipe:1'
+            )
+            audio_cmd = self._build_audio_segment_cmd(video_path, split_points, audio_pattern) if has_audio else None
             
-            # Фильтруем неуспешные результаты
-            clips_info = [clip for clip in clips_info if clip[0]]
+            # Слот занят, пока работают процессы нарезки, а не пока потребитель разбирает клипы:
+            # медленное извлечение признаков не задерживает нарезку других видео
+            await self._acquire_ffmpeg_slot()
+            try:
+                # Нарезка видео и аудио идет параллельно
+                video_process = await self.runner.spawn(video_cmd, stdout=asyncio.subprocess.PIPE)
+                processes.append(video_process)
+                video_stderr = asyncio.create_task(video_process.stderr.read())
+                
+                audio_process = None
+                audio_stderr = None
+                if audio_cmd:
+                    audio_process = await self.runner.spawn(audio_cmd)
+                    processes.append(audio_process)
+                    audio_stderr = asyncio.create_task(audio_process.stderr.read())
+            finally:
+                slot_release = asyncio.ensure_future(self._release_ffmpeg_slot(list(processes)))
             
-            logger.info(f"Создано клипов: {len(clips_info)}")
-            return clips_info
+            clip_count = 0
+            async for line in video_process.stdout:
+                row = next(csv.reader([line.decode()]), None)
+                if not row:
+                    continue
+                
+                audio_segment = None
+                if audio_process:
+                    start, end = float(row[1]), float(row[2])
+                    index = self._match_planned_segment(clip_bounds, start, end)
+                    if index is not None:
+                        audio_segment = await self._wait_audio_segment(audio_pattern, index, audio_process)
+                    else:
+                        # При копировании потока видео режется по ключевым кадрам исходника, а аудио -
+                        # по плановым границам: аудио такого клипа вырезается по его фактическим границам
+                        logger.warning(f"Границы сегмента {start:.3f}-{end:.3f}с не совпадают с плановыми, "
+                                       f"аудио вырезается отдельно: {video_path}")
+                        audio_segment = await self._cut_audio_segment(
+                            video_path, start, end, self._audio_dir_str + f"{stem}_seg_cut_{clip_count:03d}.wav"
+                        )
+                
+                clip = self._finalize_segment(stem, row, audio_segment)
+                clip_count += 1
+                yield clip
             
+            await video_process.wait()
+            if video_process.returncode != 0:
+                raise subprocess.CalledProcessError(video_process.returncode, video_cmd, stderr=await video_stderr)
+            if audio_process:
+                await audio_process.wait()
+                if audio_process.returncode != 0:
+                    raise subprocess.CalledProcessError(audio_process.returncode, audio_cmd, stderr=await audio_stderr)
+            
+            if clip_count != len(clip_bounds):
+                # При копировании потока сегменты режутся по ключевым кадрам исходника
+                logger.warning(f"Ожидалось клипов: {len(clip_bounds)}, создано: {clip_count}")
+            # Аудио-сегменты плановых границ, не совпавшие ни с одним видео-сегментом
+            self._remove_stale_segments(stem)
+            
+            logger.info(f"Создано клипов: {clip_count}")
+            
+        # Ошибка пробрасывается вызывающему коду: часть клипов уже могла быть выдана,
+        # и видео с неполным набором клипов не должно считаться обработанным
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Ошибка команды FFmpeg: {e.cmd}")
+            if e.stderr:
+                logger.error(f"Ошибка FFmpeg: {e.stderr.decode().strip()}")
+            raise
         except Exception as e:
             logger.exception(f"Ошибка обработки видео для {video_path}: {str(e)}")
-            return []
+            raise
+        finally:
+            # Если потребитель прекратил итерацию досрочно, FFmpeg не должен остаться работать
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            # Слот возвращается до закрытия event loop вызывающим кодом
+            if slot_release is not None:
+                await slot_release
+
+    async def _wait_audio_segment(self, audio_pattern: str, index: int,
+                                  audio_process: asyncio.subprocess.Process) -> Optional[str]:
+        # Аудио-сегмент с номером index закрыт, когда FFmpeg начал следующий или завершился.
+        # Аудио нарезается быстрее видео, поэтому ожидание обычно не требуется
+        segment = audio_pattern % index
+        if audio_process.returncode is None and not os.path.exists(audio_pattern % (index + 1)):
+            await audio_process.wait()
+        return segment if os.path.exists(segment) else None
+
+    def _match_planned_segment(self, clip_bounds: List[Tuple[float, float]], start: float, end: float,
+                               tolerance: float = 0.05) -> Optional[int]:
+        # Номер планового клипа с теми же границами (с точностью tolerance секунд) или None;
+        # плановые клипы идут с шагом clip_duration, поэтому номер вычисляется по началу
+        index = int(round(start / self.clip_duration))
+        if index >= len(clip_bounds):
+            return None
+        planned_start, planned_end = clip_bounds[index]
+        if abs(planned_start - start) <= tolerance and abs(planned_end - end) <= tolerance:
+            return index
+        return None
+
+    async def _cut_audio_segment(self, video_path: str, start: float, end: float, output_path: str) -> Optional[str]:
+        cmd = [
+            *FFMPEG_CMD,
+            '-ss', f"{start:.3f}",
+            '-i', video_path,
+            '-t', f"{end - start:.3f}",
+            '-map', '0:a:0',
+            '-vn',
+            '-ac', '1',
+            '-ar', '16000',
+            '-c:a', 'pcm_s16le',
+            '-threads', '1',
+            output_path
+        ]
+        returncode, stderr = await self.runner.run_one(cmd)
+        if returncode != 0:
+            logger.error(f"Ошибка вырезания аудио {start:.3f}-{end:.3f}с: {stderr.strip()}")
+            return None
+        return output_path
 
     def _get_video_info(self, video_path: str) -> dict:
         """Получаем информацию о видео один раз для всех клипов"""
         try:
-            with av.open(video_path) as container:
-                video_stream = next(s for s in container.streams if s.type == 'video')
-                duration = float(video_stream.duration * video_stream.time_base)
-                
-            has_audio = self._has_audio(video_path)
-            
-            return {
-                'duration': duration,
-                'has_audio': has_audio
-            }
+            stat = os.stat(video_path)
+            # Копия, чтобы изменения вызывающего кода не попадали в кэш
+            return dict(_probe(video_path, stat.st_mtime_ns, stat.st_size))
         except Exception as e:
             logger.error(f"Ошибка получения информации о видео {video_path}: {str(e)}")
             raise
 
-    def _create_clip_parallel(self, task_data: Tuple[str, float, float, bool]) -> Tuple[str, str]:
-        """Версия _create_clip для параллельного выполнения"""
-        video_path, start, end, has_audio = task_data
-        return self._create_clip_optimized(video_path, start, end, has_audio)
+    def _needs_reencode(self, video_info: dict) -> bool:
+        """Перекодирование нужно, если исходник не H.264/yuv420p с разрешением не выше целевого"""
+        max_width, max_height = self.target_resolution
+        return not (
+            video_info['codec_name'] == 'h264'
+            and video_info['pix_fmt'] == 'yuv420p'
+            and video_info['width'] <= max_width
+            and video_info['height'] <= max_height
+        )
+
+    def _build_video_segment_cmd(self, video_path: str, video_info: dict, split_points: List[float],
+                                 output_pattern: str, segment_list: str) -> List[str]:
+        # Одна команда FFmpeg режет всё видео на сегменты:
+        # исходник открывается и демультиплексируется один раз вместо одного раза на клип
+        reencode = self._needs_reencode(video_info)
+        cmd = list(FFMPEG_CMD)
+        if reencode and self.hw_encoder == 'h264_vaapi':
+            cmd += ['-vaapi_device', VAAPI_DEVICE]
+        cmd += ['-i', video_path, '-map', '0:v:0']
         
-    def _create_clip_optimized(self, video_path: str, start: float, end: float, has_audio: bool) -> Tuple[str, str]:
-        # Оптимизированное создание клипов с помощью FFmpeg
-        # Использует быстрые пресеты для ускорения обработки
-        # Параллельно извлекает видео и аудио если есть звук
-        base_filename = self._generate_clip_filename(video_path, start, end)
-        clip_path = self.video_dir / f"{base_filename}.mp4"
-        audio_path = self.audio_dir / f"{base_filename}.wav"
+        segment_times = self._format_segment_times(split_points)
+        if reencode:
+            cmd += self._encoder_args()
+            # Ключевые кадры ровно на границах клипов, чтобы сегменты резались точно
+            if segment_times:
+                cmd += ['-force_key_frames', segment_times]
+        else:
+            # Совместимый исходник только перепаковывается, без декодирования;
+            # сегменты режутся по существующим ключевым кадрам
+            cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
         
-        logger.debug(f"Создание клипа: {clip_path}")
+        cmd += ['-an', '-f', 'segment']  # Без аудио в видео
+        if segment_times:
+            cmd += ['-segment_times', segment_times]
+        cmd += [
+            '-reset_timestamps', '1',
+            '-segment_format_options', 'movflags=+faststart',
+            '-segment_list', segment_list,
+            '-segment_list_type', 'csv',
+            output_pattern
+        ]
+        return cmd
+
+    def _encoder_args(self) -> List[str]:
+        # Аппаратный кодировщик снимает масштабирование и кодирование с CPU;
+        # без него используется libx264 с быстрыми пресетами
+        width, height = self.target_resolution
+        scale_filter = f'scale={width}:{height}:flags=fast_bilinear,format=yuv420p'
         
-        try:
-            # Оптимизированная команда FFmpeg для видео
-            video_cmd = [
-                'ffmpeg', '-y', 
-                '-ss', str(start), 
-                '-to', str(end),
-                '-i', video_path,
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',  # Изменено с veryfast на ultrafast
-                '-crf', '30',  # Увеличено с 28 для быстрой обработки
-                '-tune', 'fastdecode',
-                '-movflags', '+faststart',
-                '-vf', f'scale={self.target_resolution[0]}:{self.target_resolution[1]}:flags=fast_bilinear,format=yuv420p',
-                '-threads', '2',  # Ограничиваем потоки для каждого процесса
-                '-an',  # Без аудио в видео
-                str(clip_path)
-            ]
-            
-            # Обрабатываем видео и аудио одновременно, если есть аудио
-            if has_audio:
-                audio_cmd = [
-                    'ffmpeg', '-y', 
-                    '-ss', str(start), 
-                    '-to', str(end),
-                    '-i', video_path, 
-                    '-ac', '1', 
-                    '-ar', '16000',
-                    '-c:a', 'pcm_s16le',
-                    '-threads', '1',
-                    str(audio_path)
-                ]
-                
-                # Запускаем обе команды параллельно
-                video_process = subprocess.Popen(video_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                audio_process = subprocess.Popen(audio_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                
-                # Ждем завершения обеих команд
-                video_result = video_process.communicate()
-                audio_result = audio_process.communicate()
-                
-                if video_process.returncode != 0:
-                    raise subprocess.CalledProcessError(video_process.returncode, video_cmd, video_result[1])
-                if audio_process.returncode != 0:
-                    raise subprocess.CalledProcessError(audio_process.returncode, audio_cmd, audio_result[1])
-                    
-                logger.debug(f"Видео и аудио клипы созданы: {clip_path}, {audio_path}")
-                return str(clip_path), str(audio_path)
-            else:
-                # Только видео
-                result = subprocess.run(video_cmd, capture_output=True, check=True)
-                logger.debug(f"Видео клип создан: {clip_path}")
-                return str(clip_path), ""
-                
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка команды FFmpeg: {e.cmd}")
-            if e.stderr:
-                logger.error(f"Ошибка FFmpeg: {e.stderr.decode().strip()}")
-            raise
-        except Exception as e:
-            logger.exception(f"Ошибка создания клипа для {video_path} [{start}-{end}с]: {str(e)}")
-            raise
+        if self.hw_encoder == 'h264_nvenc':
+            return ['-vf', scale_filter, '-c:v', 'h264_nvenc', '-preset', 'p1', '-tune', 'll', '-rc', 'vbr', '-cq', '30']
+        if self.hw_encoder == 'h264_qsv':
+            return ['-vf', scale_filter, '-c:v', 'h264_qsv', '-preset', 'veryfast', '-global_quality', '30']
+        if self.hw_encoder == 'h264_vaapi':
+            return ['-vf', f'format=nv12,hwupload,scale_vaapi={width}:{height}', '-c:v', 'h264_vaapi', '-qp', '28']
+        if self.hw_encoder == 'h264_videotoolbox':
+            return ['-vf', scale_filter, '-c:v', 'h264_videotoolbox', '-b:v', '800k']
+        
+        return [
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-crf', '30',
+            '-tune', 'fastdecode',
+            '-vf', scale_filter,
+            '-threads', str(self.ffmpeg_threads),
+        ]
 
-    def _has_audio(self, video_path: str) -> bool:
-        try:
-            # Используем более быстрый способ проверки
-            cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'stream=codec_type', 
-                   '-select_streams', 'a:0', '-of', 'csv=p=0', video_path]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            has_audio = result.stdout.strip() == 'audio'
-            logger.debug(f"Проверка аудио для {video_path}: {has_audio}")
-            return has_audio
-        except Exception as e:
-            logger.warning(f"Ошибка проверки аудио для {video_path}: {str(e)}")
-            return False
+    def _build_audio_segment_cmd(self, video_path: str, split_points: List[float], output_pattern: str) -> List[str]:
+        segment_times = self._format_segment_times(split_points)
+        cmd = [
+            *FFMPEG_CMD,
+            '-i', video_path,
+            '-map', '0:a:0',
+            '-vn',
+            '-ac', '1',
+            '-ar', '16000',
+            '-c:a', 'pcm_s16le',
+            '-threads', '1',
+            '-f', 'segment'
+        ]
+        if segment_times:
+            cmd += ['-segment_times', segment_times]
+        cmd += ['-reset_timestamps', '1', output_pattern]
+        return cmd
 
-    def _generate_clip_filename(self, video_path: str, start: float, end: float) -> str:
-        base_name = Path(video_path).stem
-        return f"{base_name}_{start:.1f}_{end:.1f}"
+    @staticmethod
+    def _format_segment_times(split_points: List[float]) -> str:
+        # Пустая строка - видео короче одного клипа, резать не нужно
+        return ",".join(f"{t:.3f}" for t in split_points)
 
-    def process_multiple_videos(self, video_paths: List[str]) -> dict:
-        """Обработка нескольких видео с общим пулом потоков"""
-        all_results = {}
+    def _remove_stale_segments(self, stem: str) -> None:
+        """Удаляет сегменты, оставшиеся от прерванной обработки того же видео"""
+        # scandir со сравнением префикса: без fnmatch и объектов Path на каждую запись,
+        # и символы glob ([, *) в имени видео не ломают поиск
+        prefix = f"{stem}_seg_"
+        for directory, suffix in ((self._video_dir_str, '.mp4'), (self._audio_dir_str, '.wav')):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith(prefix) and entry.name.endswith(suffix):
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            pass
+
+    def _finalize_segment(self, stem: str, row: List[str],
+                          audio_segment: Optional[str]) -> Tuple[str, str]:
+        # Строка списка сегментов "файл,начало,конец" содержит фактические границы сегмента;
+        # по ним клип получает имя {имя}_{id}_{начало}_{конец}
+        segment_name, start, end = row[0], float(row[1]), float(row[2])
+        base_filename = self._generate_clip_filename(stem, start, end)
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_video = {
-                executor.submit(self.process_video, video_path): video_path 
-                for video_path in video_paths
-            }
-            
-            for future in future_to_video:
-                video_path = future_to_video[future]
-                try:
-                    result = future.result()
-                    all_results[video_path] = result
-                except Exception as e:
-                    logger.error(f"Ошибка обработки {video_path}: {str(e)}")
-                    all_results[video_path] = []
+        clip_path = self._video_dir_str + base_filename + ".mp4"
+        os.replace(self._video_dir_str + os.path.basename(segment_name), clip_path)
         
-        return all_results
\ No newline at end of file
+        audio_path = ""
+        if audio_segment:
+            audio_path = self._audio_dir_str + base_filename + ".wav"
+            os.replace(audio_segment, audio_path)
+        
+        logger.debug(f"Клип создан: {clip_path}")
+        return clip_path, audio_path
+
+    @staticmethod
+    def _clip_stem(video_path: str, clip_id: str = None) -> str:
+        # Имя файла и идентификатор содержимого: одноименные видео разного содержания, в том числе
+        # обрабатываемые одновременно, не удаляют и не перезаписывают сегменты и клипы друг друга
+        if clip_id is None:
+            clip_id = hashlib.sha1(os.path.abspath(video_path).encode()).hexdigest()
+        return f"{Path(video_path).stem}_{clip_id[:12]}"
+
+    @staticmethod
+    def _generate_clip_filename(stem: str, start: float, end: float) -> str:
+        return f"{stem}_{start:.1f}_{end:.1f}"
+
+    def max_clip_count(self, video_path: str) -> int:
+        # Верхняя граница числа клипов: при копировании потока соседние границы
+        # могут попасть на один ключевой кадр, и клипов получится меньше
+        duration = self._get_video_info(video_path)['duration']
+        return int(np.ceil(duration / self.clip_duration)) if duration > 0 else 0
+
+    def clip_time_range(self, clip_path: str) -> Tuple[float, float]:
+        """Границы клипа в исходном видео, восстановленные из имени {имя}_{начало}_{конец}"""
+        _, start, end = Path(clip_path).stem.rsplit('_', 2)
+        return float(start), float(end)
+
+    def process_multiple_videos(self, video_paths: List[str]) -> dict:
+        """Обработка нескольких видео с общим ограничением на число процессов FFmpeg"""
+        return asyncio.run(self._process_multiple_videos_async(video_paths))
+
+    async def _process_multiple_videos_async(self, video_paths: List[str]) -> dict:
+        results = await asyncio.gather(
+            *(self._process_video_async(video_path) for video_path in video_paths)
+        )
+        return dict(zip(video_paths, results))
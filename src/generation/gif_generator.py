@@ -1,18 +1,72 @@
+import os
+import hashlib
 import subprocess
 import logging
+import json
+import uuid
+from concurrent.futures import as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Tuple
+
+from ..config import Config
+from ..utils.pool import get_pool
+from ..utils.subprocess_runner import AsyncSubprocessRunner, FFMPEG_CMD, warm_ffmpeg
 
 logger = logging.getLogger(__name__)
 
+# GIF создаются параллельно в общем пуле: параллелизм задает пул, а не потоки внутри FFmpeg.
+# -threads перед первым -i ограничивает декодер видео
+GIF_FFMPEG_CMD = (*FFMPEG_CMD, '-filter_threads', '1', '-filter_complex_threads', '1', '-threads', '1')
+
+@lru_cache(maxsize=512)
+def _probe_gif(gif_path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    # mtime и размер входят в ключ кэша: перезаписанный GIF будет прочитан заново.
+    # Запрашиваются только нужные поля первого видеопотока, а не полный дамп потоков
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=codec_type,width,height',
+        gif_path
+    ]
+    # Нужен только JSON из stdout; stderr при -v quiet пуст
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+        text=True, close_fds=False
+    )
+    if result.returncode != 0:
+        return {}
+    
+    info = json.loads(result.stdout)
+    
+    duration = float(info.get('format', {}).get('duration', 0))
+    streams = info.get('streams', [])
+    
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    return {
+        'duration': duration,
+        'width': video_stream.get('width', 0),
+        'height': video_stream.get('height', 0)
+    }
+
 class GifGenerator:
     '''
     Класс GifGenerator создает анимированные GIF-превью из видеоклипов для визуального представления результатов поиска.
     '''
     def __init__(self, base_dir: Path):
         self.base_dir = base_dir
-        self.gif_dir = base_dir / "gifs"
-        self.gif_dir.mkdir(parents=True, exist_ok=True)
+        self.gif_dir = Config.GIF_TMP_DIR
+        try:
+            self.gif_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Каталог GIF {self.gif_dir} недоступен, используется {base_dir / 'gifs'}: {e}")
+            self.gif_dir = base_dir / "gifs"
+            self.gif_dir.mkdir(parents=True, exist_ok=True)
+        self._gif_dir_str = str(self.gif_dir) + os.sep
+        # Палитры хранятся на диске и переживают перезапуск приложения
+        self.palette_dir = self.gif_dir / "_palettes"
+        self.palette_dir.mkdir(exist_ok=True)
+        self._palette_dir_str = str(self.palette_dir) + os.sep
         
         self.default_settings = {
             'fps': 10,
@@ -20,17 +74,22 @@ class GifGenerator:
             'quality': 'medium',
             'max_duration': 10
         }
+        # Палитры, уже построенные для клипов: (путь_к_клипу, fps, ширина, качество) -> путь к PNG
+        self._palette_cache = {}
+        self.runner = AsyncSubprocessRunner()
+        # Прогрев FFmpeg идет в фоне и не задерживает инициализацию
+        get_pool().submit(warm_ffmpeg)
         
         logger.info(f"Инициализация GifGenerator в {base_dir}")
     
     def create_gif_from_clip(self, clip_path: str, start_time: float, end_time: float, 
-                           output_name: str = None, **kwargs) -> str:
+                           output_name: str = None, palette_path: str = None, **kwargs) -> str:
         # 1. Проверяет существование исходного клипа
         # 2. Ограничивает длительность GIF (max 10 сек)
-        # 3. Создает GIF с помощью FFmpeg с оптимизированными настройками
+        # 3. Создает GIF тем же проходом FFmpeg, что и GIF результатов поиска (группа из одного GIF)
         # 4. Возвращает путь к созданному GIF
         try:
-            if not Path(clip_path).exists():
+            if not os.path.isfile(clip_path):
                 logger.error(f"Файл клипа не найден: {clip_path}")
                 return None
             
@@ -45,18 +104,17 @@ class GifGenerator:
                 clip_name = Path(clip_path).stem
                 output_name = f"{clip_name}_{start_time:.1f}_{end_time:.1f}"
             
-            gif_path = self.gif_dir / f"{output_name}.gif"
-            
-            success = self._create_gif_ffmpeg(
-                clip_path, gif_path, start_time, duration, settings
-            )
+            if not palette_path:
+                # Для одного GIF отдельное построение палитры не окупается: только готовая из кэша
+                palette_path = self._get_palettes([clip_path], settings, build=False)[clip_path]
             
-            if success and gif_path.exists():
-                logger.info(f"GIF создан: {gif_path}")
-                return str(gif_path)
-            else:
-                logger.error(f"Ошибка создания GIF: {gif_path}")
-                return None
+            job = {
+                'input_path': clip_path,
+                'start': start_time,
+                'duration': duration,
+                'gif_path': self._gif_dir_str + output_name + ".gif"
+            }
+            return self._create_gif_batch([job], palette_path, settings)[0]
                 
         except Exception as e:
             logger.exception(f"Ошибка создания GIF: {e}")
@@ -64,111 +122,293 @@ class GifGenerator:
     
     def create_gifs_from_results(self, search_results: List[Dict[str, Any]], 
                                max_gifs: int = 3) -> List[Dict[str, str]]:
+        # Результаты собираются по мере готовности и раскладываются по индексу,
+        # чтобы сохранить порядок ранжирования
+        ordered = [None] * min(len(search_results), max_gifs)
+        for i, info in self.iter_gifs_from_results(search_results, max_gifs):
+            ordered[i] = info
+        gif_info = [info for info in ordered if info]
+        
+        logger.info(f"Создано GIF: {len(gif_info)} из {len(search_results)} результатов")
+        return gif_info
+    
+    def iter_gifs_from_results(self, search_results: List[Dict[str, Any]],
+                               max_gifs: int = 3) -> Iterator[Tuple[int, Dict[str, str]]]:
+        # Выдает пары (позиция результата, информация о GIF) по мере готовности,
+        # чтобы интерфейс показывал первые GIF, не дожидаясь остальных.
+        # GIF из одного клипа создаются одним процессом FFmpeg (декодер инициализируется один раз),
+        # разные клипы обрабатываются параллельно в общем пуле потоков
         try:
-            gif_info = []
-            
-            for i, result in enumerate(search_results[:max_gifs]):
-                try:
-                    metadata = result['metadata']
-                    clip_path = metadata.get('clip_path')
-                    
-                    if not clip_path or not Path(clip_path).exists():
-                        logger.warning(f"Недопустимый путь к клипу для результата {i}: {clip_path}")
-                        continue
-                    
-                    start_time = metadata.get('start_time', 0)
-                    end_time = metadata.get('end_time', start_time + 5)
-                    score = result.get('score', 0)
-                    
-                    output_name = f"result_{i+1}_score_{score:.3f}"
-                    
-                    gif_path = self.create_gif_from_clip(
-                        clip_path, start_time, min(end_time, start_time + 8), 
-                        output_name, fps=8, width=280
-                    )
-                    
+            gif_settings = {**self.default_settings, 'fps': 8, 'width': 280}
+            selected = search_results[:max_gifs]
+            # Поиски выполняются одновременно: у GIF каждого запроса свои имена файлов,
+            # и одинаковые запросы не перезаписывают файлы, которые Gradio уже отдает
+            request_token = uuid.uuid4().hex[:12]
+            pool = get_pool()
+            
+            clip_paths = dict.fromkeys(
+                result.get('metadata', {}).get('clip_path') for result in selected
+            )
+            existing_clips = [
+                clip_path for clip_path in clip_paths
+                if clip_path and os.path.isfile(clip_path)
+            ]
+            # Сначала только готовые палитры: построение палитры - отдельное декодирование всего клипа
+            palettes = self._get_palettes(existing_clips, gif_settings, build=False)
+            
+            # Результаты группируются по клипу: интервал декодирования одной группы не длиннее клипа
+            groups = {}
+            for i, result in enumerate(selected):
+                job = self._plan_result_gif(i, result, palettes, gif_settings, request_token)
+                if job:
+                    groups.setdefault(job['clip_path'], []).append(job)
+            
+            # Общая палитра клипа строится заранее только для групп из нескольких GIF;
+            # одиночный GIF получает палитру в своем же проходе по 8-секундному фрагменту
+            shared = [
+                clip_path for clip_path, jobs in groups.items()
+                if len(jobs) > 1 and clip_path in palettes and not palettes[clip_path]
+            ]
+            if shared:
+                palettes.update(self._get_palettes(shared, gif_settings))
+            
+            futures = {
+                pool.submit(self._create_gif_batch, jobs, palettes.get(clip_path), gif_settings): jobs
+                for clip_path, jobs in groups.items()
+            }
+            for future in as_completed(futures):
+                for job, gif_path in zip(futures[future], future.result()):
                     if gif_path:
-                        gif_info.append({
-                            'gif_path': gif_path,
-                            'original_clip': clip_path,
-                            'start_time': start_time,
-                            'end_time': end_time,
-                            'score': score,
-                            'visual_description': metadata.get('visual_description', ''),
-                            'transcript': metadata.get('transcript', ''),
-                            'source_video': metadata.get('source_video', '')
-                        })
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка создания GIF для результата {i}: {e}")
-                    continue
-            
-            logger.info(f"Создано GIF: {len(gif_info)} из {len(search_results)} результатов")
-            return gif_info
+                        yield job['index'], {'gif_path': gif_path, **job['info']}
             
         except Exception as e:
             logger.exception(f"Ошибка пакетного создания GIF: {e}")
-            return []
     
-    def _create_gif_ffmpeg(self, input_path: str, output_path: str, 
-                          start_time: float, duration: float, settings: dict) -> bool:
+    def _plan_result_gif(self, i: int, result: Dict[str, Any], palettes: Dict[str, str],
+                         settings: dict, request_token: str) -> Dict[str, Any]:
+        # palettes содержит только существующие клипы: клип -> путь к палитре (или None)
         try:
-            if settings['quality'] == 'high':
-                vf_options = f"fps={settings['fps']},scale={settings['width']}:-1:flags=lanczos,split[s0][s1];[s0]palettegen=max_colors=256[p];[s1][p]paletteuse=dither=bayer:bayer_scale=3"
-            elif settings['quality'] == 'low':
-                vf_options = f"fps={settings['fps']},scale={settings['width']}:-1:flags=fast_bilinear"
+            metadata = result['metadata']
+            clip_path = metadata.get('clip_path')
+            source_path = metadata.get('source_path')
+            
+            start_time = metadata.get('start_time', 0)
+            end_time = metadata.get('end_time', start_time + 5)
+            score = result.get('score', 0)
+            gif_end = min(end_time, start_time + 8)
+            
+            if source_path and Path(source_path).exists():
+                # Время в метаданных отсчитывается от начала клипа
+                clip_start = metadata.get('clip_start', 0.0)
+                input_path, input_start = source_path, clip_start + start_time
+            elif clip_path in palettes:
+                input_path, input_start = clip_path, start_time
             else:
-                vf_options = f"fps={settings['fps']},scale={settings['width']}:-1:flags=lanczos,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse"
-            
-            cmd = [
-                'ffmpeg', '-y',
-                '-ss', str(start_time),
-                '-t', str(duration),
-                '-i', input_path,
-                '-vf', vf_options,
-                '-loop', '0',
-                str(output_path)
-            ]
+                logger.warning(f"Недопустимый путь к клипу для результата {i}: {clip_path}")
+                return None
             
-            logger.debug(f"Создание GIF командой: {' '.join(cmd)}")
+            duration = min(gif_end - start_time, settings['max_duration'])
+            if duration <= 0:
+                logger.warning(f"Недопустимая длительность: {duration}")
+                return None
+            
+            return {
+                'index': i,
+                'clip_path': clip_path,
+                'input_path': input_path,
+                'start': input_start,
+                'duration': duration,
+                'gif_path': self._gif_dir_str + f"result_{request_token}_{i+1}_score_{score:.3f}.gif",
+                'info': {
+                    'original_clip': clip_path,
+                    'start_time': start_time,
+                    'end_time': end_time,
+                    'score': score,
+                    'visual_description': metadata.get('visual_description', ''),
+                    'transcript': metadata.get('transcript', ''),
+                    'source_video': metadata.get('source_video', '')
+                }
+            }
             
+        except Exception as e:
+            logger.error(f"Ошибка подготовки GIF для результата {i}: {e}")
+            return None
+    
+    def _create_gif_batch(self, jobs: List[Dict[str, Any]], palette_path: str,
+                          settings: dict) -> List[str]:
+        # Один FFmpeg на группу: вход открывается и декодируется один раз,
+        # каждый GIF - отдельный выход filter_complex с trim по своему интервалу
+        cmd = self._build_batch_gif_cmd(jobs, palette_path, settings)
+        logger.debug(f"Создание GIF командой: {' '.join(cmd)}")
+        
+        try:
             result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=60
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                text=True,
+                timeout=60,
+                close_fds=False
             )
-            
-            if result.returncode == 0:
-                file_size = Path(output_path).stat().st_size / (1024 * 1024)
-                logger.debug(f"GIF успешно создан. Размер: {file_size:.2f} МБ")
-                return True
-            else:
-                logger.error(f"Ошибка ffmpeg: код {result.returncode}")
-                logger.error(f"stderr: {result.stderr}")
-                return False
-                
         except subprocess.TimeoutExpired:
             logger.error("Таймаут создания GIF")
-            return False
-        except Exception as e:
-            logger.error(f"Ошибка создания GIF: {e}")
+            return [None] * len(jobs)
+        
+        if result.returncode != 0:
+            logger.error(f"Ошибка ffmpeg: код {result.returncode}")
+            logger.error(f"stderr: {result.stderr}")
+            return [None] * len(jobs)
+        
+        gif_paths = []
+        for job in jobs:
+            if os.path.isfile(job['gif_path']):
+                logger.info(f"GIF создан: {job['gif_path']}")
+                gif_paths.append(job['gif_path'])
+            else:
+                logger.error(f"Ошибка создания GIF: {job['gif_path']}")
+                gif_paths.append(None)
+        return gif_paths
+    
+    def _build_batch_gif_cmd(self, jobs: List[Dict[str, Any]], palette_path: str,
+                             settings: dict) -> List[str]:
+        # Вход читается только на интервале, покрывающем все GIF группы
+        seek = min(job['start'] for job in jobs)
+        span = max(job['start'] + job['duration'] for job in jobs) - seek
+        count = len(jobs)
+        frame_filter = self._frame_filter(settings)
+        paletteuse = self._paletteuse_filter(settings)
+        use_palette = bool(palette_path) and self._uses_palette(settings)
+        
+        cmd = [
+            *GIF_FFMPEG_CMD,
+            '-ss', f"{seek:.3f}",
+            '-t', f"{span:.3f}",
+            '-i', jobs[0]['input_path']
+        ]
+        graph = [f"[0:v]split={count}" + "".join(f"[v{k}]" for k in range(count))]
+        if use_palette:
+            # Готовая палитра клипа общая для всех выходов
+            cmd += ['-i', palette_path]
+            graph.append(f"[1:v]split={count}" + "".join(f"[p{k}]" for k in range(count)))
+        
+        for k, job in enumerate(jobs):
+            trim = (
+                f"[v{k}]trim=start={job['start'] - seek:.3f}:duration={job['duration']:.3f},"
+                f"setpts=PTS-STARTPTS,{frame_filter}"
+            )
+            if use_palette:
+                graph.append(f"{trim}[f{k}];[f{k}][p{k}]{paletteuse}[o{k}]")
+            elif self._uses_palette(settings):
+                graph.append(
+                    f"{trim},split[a{k}][b{k}];[a{k}]{self._palettegen_filter(settings)}[q{k}];"
+                    f"[b{k}][q{k}]{paletteuse}[o{k}]"
+                )
+            else:
+                graph.append(f"{trim}[o{k}]")
+        
+        cmd += ['-filter_complex', ";".join(graph)]
+        for k, job in enumerate(jobs):
+            cmd += ['-map', f"[o{k}]", '-loop', '0', job['gif_path']]
+        return cmd
+    
+    def _frame_filter(self, settings: dict) -> str:
+        # Прореживание кадров и масштабирование; палитра строится для всех качеств, кроме low
+        if settings['quality'] == 'low':
+            return f"fps={settings['fps']},scale={settings['width']}:-1:flags=fast_bilinear"
+        return f"fps={settings['fps']},scale={settings['width']}:-1:flags=lanczos"
+    
+    @staticmethod
+    def _uses_palette(settings: dict) -> bool:
+        return settings['quality'] != 'low'
+    
+    def _palettegen_filter(self, settings: dict) -> str:
+        if settings['quality'] == 'high':
+            return "palettegen=max_colors=256"
+        return "palettegen"
+    
+    def _paletteuse_filter(self, settings: dict) -> str:
+        if settings['quality'] == 'high':
+            return "paletteuse=dither=bayer:bayer_scale=3"
+        return "paletteuse"
+    
+    def _get_palettes(self, clip_paths: List[str], settings: dict, build: bool = True) -> Dict[str, str]:
+        # Палитры клипов из кэша (в памяти или на диске); при build=True недостающие строятся
+        # по всему клипу отдельным проходом palettegen, одновременно в одном event loop.
+        # None - палитры нет, GIF строит ее сам в своем проходе
+        if not self._uses_palette(settings):
+            return dict.fromkeys(clip_paths)
+        
+        palettes = {}
+        pending = []
+        frame_filter = self._frame_filter(settings)
+        for clip_path in clip_paths:
+            key = (clip_path, settings['fps'], settings['width'], settings['quality'])
+            palettes[clip_path] = self._palette_cache.get(key)
+            if palettes[clip_path]:
+                continue
+            
+            palette_path = self._palette_file(key)
+            if self._palette_is_fresh(palette_path, clip_path):
+                # Палитра построена ранее (в том числе до перезапуска) и клип с тех пор не менялся
+                self._palette_cache[key] = palette_path
+                palettes[clip_path] = palette_path
+            elif build:
+                pending.append((key, palette_path, [
+                    *GIF_FFMPEG_CMD,
+                    '-i', clip_path,
+                    '-vf', f"{frame_filter},{self._palettegen_filter(settings)}",
+                    palette_path
+                ]))
+        
+        results = self.runner.run([cmd for _, _, cmd in pending], timeout=60)
+        for (key, palette_path, _), result in zip(pending, results):
+            clip_path = key[0]
+            if isinstance(result, subprocess.TimeoutExpired):
+                logger.warning(f"Таймаут построения палитры для {clip_path}")
+            elif isinstance(result, Exception):
+                logger.warning(f"Ошибка построения палитры для {clip_path}: {result}")
+            elif result[0] != 0:
+                logger.warning(f"Ошибка построения палитры для {clip_path}: {result[1]}")
+            else:
+                self._palette_cache[key] = palette_path
+                palettes[clip_path] = palette_path
+        
+        return palettes
+    
+    def _palette_file(self, key: tuple) -> str:
+        # Имя файла - хэш ключа: клипы с одинаковым именем из разных каталогов не пересекаются
+        digest = hashlib.sha1("|".join(map(str, key)).encode()).hexdigest()[:16]
+        return self._palette_dir_str + digest + ".png"
+    
+    @staticmethod
+    def _palette_is_fresh(palette_path: str, clip_path: str) -> bool:
+        try:
+            return os.stat(palette_path).st_mtime >= os.stat(clip_path).st_mtime
+        except OSError:
             return False
     
     def cleanup_old_gifs(self, max_age_hours: int = 24):
+        # Один проход scandir: stat каждой записи читается один раз
         try:
             import time
-            current_time = time.time()
+            cutoff = time.time() - max_age_hours * 3600
             deleted_count = 0
+            errors = []
+            
+            with os.scandir(self.gif_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.gif'):
+                        continue
+                    try:
+                        if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                            os.unlink(entry.path)
+                            deleted_count += 1
+                    except OSError as e:
+                        errors.append(f"{entry.path}: {e}")
             
-            for gif_file in self.gif_dir.glob("*.gif"):
-                try:
-                    file_age = current_time - gif_file.stat().st_mtime
-                    if file_age > (max_age_hours * 3600):
-                        gif_file.unlink()
-                        deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Ошибка удаления {gif_file}: {e}")
+            if errors:
+                logger.warning(f"Ошибки удаления GIF ({len(errors)}): {'; '.join(errors)}")
             
             if deleted_count > 0:
                 logger.info(f"Удалено старых GIF: {deleted_count}")
@@ -179,35 +419,20 @@ class GifGenerator:
     def get_gif_info(self, gif_path: str) -> Dict[str, Any]:
         try:
             path = Path(gif_path)
-            if not path.exists():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
                 return None
             
-            file_size = path.stat().st_size
+            file_size = stat.st_size
             
             try:
-                cmd = [
-                    'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                    '-show_format', '-show_streams', str(path)
-                ]
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                
-                if result.returncode == 0:
-                    import json
-                    info = json.loads(result.stdout)
-                    
-                    duration = float(info.get('format', {}).get('duration', 0))
-                    streams = info.get('streams', [])
-                    
-                    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
-                    width = video_stream.get('width', 0)
-                    height = video_stream.get('height', 0)
-                    
+                details = _probe_gif(str(path), stat.st_mtime_ns, file_size)
+                if details:
                     return {
                         'file_size': file_size,
                         'file_size_mb': file_size / (1024 * 1024),
-                        'duration': duration,
-                        'width': width,
-                        'height': height,
+                        **details,
                         'path': str(path)
                     }
             except Exception as e:
@@ -221,4 +446,4 @@ class GifGenerator:
             
         except Exception as e:
             logger.error(f"Ошибка получения информации о GIF: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -1,79 +1,261 @@
 import faiss
 import numpy as np
 from typing import List, Dict, Any
+import os
 import json
+import threading
 from pathlib import Path
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+def _loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 class VectorStore:
     '''
     Класс VectorStore управляет векторным хранилищем для семантического поиска с использованием библиотеки FAISS.
     '''
-    def __init__(self, model, dimension: int = 1024):
+    def __init__(self, model, dimension: int = 1024, hnsw_m: int = 32):
         self.model = model
         self.dimension = dimension
-        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self.hnsw_m = hnsw_m
+        # HNSW-граф вместо полного перебора: поиск за логарифмическое время от числа клипов.
+        # Векторы хранятся в FP16: вдвое меньше памяти и трафика при сравнении.
+        # Векторы нормализуются, поэтому скалярное произведение равно косинусному сходству
+        self.index = faiss.IndexIDMap2(
+            faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_fp16, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        )
         self.metadata_map = {}
         self.next_id = 0
+        # Куда и до какого ID метаданные уже сохранены: save дописывает только новые записи
+        self._saved_path = None
+        self._saved_next_id = 0
+        # FAISS не допускает поиск одновременно с добавлением: обработка видео и поиск
+        # выполняются в разных потоках интерфейса
+        self._lock = threading.RLock()
+        # Сохранения и перестроения индекса выполняются по одному, без удержания self._lock
+        self._save_lock = threading.Lock()
+        self._upgrade_lock = threading.Lock()
+        # Индекс, загруженный через mmap, доступен только для чтения: перед первым добавлением
+        # он перечитывается в память из файла
+        self._mmap_source = None
 
     def add_video(self, video_path: str, metadata: Dict[str, Any], embeddings: np.ndarray) -> None:
-        # 1. Нормализует эмбеддинги для косинусного сходства
-        # 2. Добавляет в FAISS индекс с уникальным ID
-        # 3. Сохраняет метаданные для восстановления контекста
         if embeddings.ndim == 1:
             embeddings = embeddings.reshape(1, -1)
+        self.add_videos([metadata], embeddings)
+
+    def add_videos(self, metadatas: List[Dict[str, Any]], embeddings: np.ndarray) -> List[int]:
+        # 1. Нормализует эмбеддинги для косинусного сходства одним вызовом на весь пакет
+        # 2. Добавляет в FAISS индекс с последовательными уникальными ID
+        # 3. Сохраняет метаданные для восстановления контекста
+        # 4. Возвращает присвоенные ID
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Неверная размерность эмбеддингов: {embeddings.shape}, ожидалось (N, {self.dimension})")
         
-        if embeddings.shape[1] != self.dimension:
-            raise ValueError(f"Неверная размерность эмбеддинга: {embeddings.shape[1]}, ожидалось {self.dimension}")
+        if len(metadatas) != embeddings.shape[0]:
+            raise ValueError(f"Число метаданных ({len(metadatas)}) не совпадает с числом эмбеддингов ({embeddings.shape[0]})")
         
-        embeddings = embeddings.astype('float32')
+        # FAISS принимает только float32 и сам квантует векторы при добавлении: непрерывный
+        # float32-массив используется без копии (и нормализуется на месте), FP16 приводится к float32
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
         faiss.normalize_L2(embeddings)
         
-        video_id = self.next_id
-        self.index.add_with_ids(embeddings, np.array([video_id], dtype=np.int64))
-        
-        metadata['id'] = video_id
-        self.metadata_map[video_id] = metadata
-        self.next_id += 1
+        with self._lock:
+            self._ensure_writable()
+            if not self.index.is_trained:
+                # FP16 обучения не требует; проверка нужна для квантователей с обучением
+                self.index.train(embeddings)
+            
+            ids = np.arange(self.next_id, self.next_id + len(metadatas), dtype=np.int64)
+            self.index.add_with_ids(embeddings, ids)
+            
+            for video_id, metadata in zip(ids.tolist(), metadatas):
+                metadata['id'] = video_id
+                self.metadata_map[video_id] = metadata
+            self.next_id += len(metadatas)
+            return ids.tolist()
 
-    def search(self, query_vector: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
-        # 1. Нормализует поисковый вектор
-        # 2. Выполняет поиск ближайших соседей в FAISS
+    def upgrade_index(self, threshold: int = 10_000, nlist: int = 256, nprobe: int = 16,
+                      encoding: str = "PQ64") -> bool:
+        # Для большого корпуса HNSW-граф заменяется на IVF с продуктовым квантованием:
+        # 64 байта на вектор вместо 2 КБ в FP16, поиск только по nprobe ближайшим кластерам.
+        # encoding="SQ8" - 8-битное скалярное квантование: точнее, но 1 КБ на вектор.
+        # Обучение IVF и PQ требует заметно больше векторов, чем кластеров, поэтому переход - по порогу
+        with self._upgrade_lock:
+            with self._lock:
+                if self.index.ntotal < max(threshold, nlist * 39):
+                    return False
+                if faiss.try_extract_index_ivf(self.index) is not None:
+                    return False
+                
+                self._ensure_writable()
+                source = self.index
+                ids = faiss.vector_to_array(source.id_map).astype(np.int64)
+                vectors = source.index.reconstruct_n(0, source.ntotal)
+            
+            # Обучение и заполнение нового индекса идут без блокировки: поиск и добавление
+            # продолжают работать с прежним индексом
+            index = faiss.index_factory(self.dimension, f"IDMap2,IVF{nlist},{encoding}", faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.add_with_ids(vectors, ids)
+            faiss.extract_index_ivf(index).nprobe = nprobe
+            
+            with self._lock:
+                if self.index is not source:
+                    # Индекс заменен загрузкой: новый индекс построен по устаревшим данным
+                    return False
+                # Векторы, добавленные во время обучения, переносятся перед подменой
+                added = source.ntotal - len(ids)
+                if added:
+                    added_ids = faiss.vector_to_array(source.id_map)[len(ids):].astype(np.int64)
+                    index.add_with_ids(source.index.reconstruct_n(len(ids), added), added_ids)
+                self.index = index
+            logger.info(f"Индекс переведен на IVF{nlist},{encoding}: векторов {index.ntotal}")
+            return True
+
+    def _ensure_writable(self) -> None:
+        if self._mmap_source is not None:
+            logger.info("Загрузка индекса в память для добавления новых векторов")
+            self.index = faiss.read_index(self._mmap_source)
+            self._mmap_source = None
+
+    def search(self, query_vector: np.ndarray, k: int = 5, nprobe: int = None,
+               normalized: bool = False) -> List[Dict[str, Any]]:
+        # Результаты для первого (обычно единственного) поискового вектора
+        return self.search_batch(query_vector, k, nprobe=nprobe, normalized=normalized)[0]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int = 5, nprobe: int = None,
+                     normalized: bool = False) -> List[List[Dict[str, Any]]]:
+        # 1. Нормализует поисковые векторы (normalized=True - уже нормализованы вызывающим кодом)
+        # 2. Выполняет поиск ближайших соседей в FAISS одним вызовом на все запросы
+        #    (nprobe - число просматриваемых кластеров IVF, None - значение индекса; для HNSW не используется)
         # 3. Восстанавливает метаданные для найденных результатов
-        # 4. Сортирует по релевантности (косинусное сходство)
-        if query_vector.ndim == 1:
-            query_vector = query_vector.reshape(1, -1)
+        # 4. Порядок по релевантности задает FAISS: результаты уже отсортированы по убыванию сходства
+        if query_vectors.ndim == 1:
+            query_vectors = query_vectors.reshape(1, -1)
         
-        query_vector = query_vector.astype('float32')
-        faiss.normalize_L2(query_vector)
+        if normalized:
+            query_vectors = np.ascontiguousarray(query_vectors, dtype='float32')
+        else:
+            query_vectors = query_vectors.astype('float32')
+            faiss.normalize_L2(query_vectors)
         
-        distances, indices = self.index.search(query_vector, k)
-        
-        results = []
-        for i in range(len(indices[0])):
-            if indices[0][i] != -1:
-                video_id = indices[0][i]
-                results.append({
-                    'metadata': self.metadata_map.get(video_id, {}),
-                    'score': float(distances[0][i])
-                })
-        
-        return sorted(results, key=lambda x: x['score'], reverse=True)
+        with self._lock:
+            ivf = faiss.try_extract_index_ivf(self.index) if nprobe is not None else None
+            if ivf is not None:
+                default_nprobe, ivf.nprobe = ivf.nprobe, nprobe
+                try:
+                    distances, indices = self.index.search(query_vectors, k)
+                finally:
+                    ivf.nprobe = default_nprobe
+            else:
+                distances, indices = self.index.search(query_vectors, k)
+            
+            results = []
+            for row_distances, row_indices in zip(distances, indices):
+                # -1 означает, что в индексе меньше k векторов
+                valid = row_indices != -1
+                results.append([
+                    {'metadata': self.metadata_map.get(video_id, {}), 'score': score}
+                    for video_id, score in zip(row_indices[valid].tolist(), row_distances[valid].tolist())
+                ])
+            return results
 
     def save(self, path: Path) -> None:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.index, str(path.with_suffix('.index')))
-        with open(path.with_suffix('.json'), 'w') as f:
-            json.dump({
-                'metadata_map': self.metadata_map,
-                'next_id': self.next_id
-            }, f)
+        # Метаданные хранятся в append-only JSONL (одна строка на клип):
+        # при повторном сохранении дописываются только клипы, добавленные после прошлого save.
+        # Под блокировкой хранилища только снимок данных в памяти; запись на диск идет без нее,
+        # и поиск не ждет окончания сохранения
+        with self._save_lock:
+            metadata_path = path.with_suffix('.jsonl')
+            with self._lock:
+                if self._saved_path == metadata_path and metadata_path.exists():
+                    mode, first_id = 'ab', self._saved_next_id
+                else:
+                    mode, first_id = 'wb', 0
+                next_id = self.next_id
+                records = [
+                    _dumps({'id': video_id, 'metadata': self.metadata_map[video_id]}) + b'\n'
+                    for video_id in range(first_id, next_id) if video_id in self.metadata_map
+                ]
+                # Сериализация в память - копирование, без ввода-вывода
+                index_data = faiss.serialize_index(self.index)
+            
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Метаданные пишутся раньше индекса: после сбоя между двумя записями метаданные
+            # без векторов безвредны, а векторы без метаданных привели бы к повторному
+            # использованию их ID после загрузки
+            with open(metadata_path, mode) as f:
+                f.writelines(records)
+            self._saved_path = metadata_path
+            self._saved_next_id = next_id
+            
+            # Индекс пишется одним последовательным потоком во временный файл и подменяется
+            # переименованием: прерванная запись не портит прежний индекс, а файл, открытый
+            # через mmap, не перезаписывается на месте
+            index_file = path.with_suffix('.index')
+            tmp_file = index_file.with_name(index_file.name + '.tmp')
+            index_data.tofile(str(tmp_file))
+            os.replace(tmp_file, index_file)
+
+    def _next_index_id(self) -> int:
+        # Следующий свободный ID по самим векторам индекса (IndexIDMap2 хранит их ID)
+        if self.index.ntotal == 0 or not hasattr(self.index, 'id_map'):
+            return 0
+        return int(faiss.vector_to_array(self.index.id_map).max()) + 1
 
     def load(self, path: Path) -> None:
-        self.index = faiss.read_index(str(path.with_suffix('.index')))
-        with open(path.with_suffix('.json'), 'r') as f:
-            data = json.load(f)
-            self.metadata_map = data['metadata_map']
-            self.next_id = data['next_id']
\ No newline at end of file
+        with self._lock:
+            index_file = str(path.with_suffix('.index'))
+            try:
+                # Страницы индекса подгружаются ОС по требованию: без пика памяти при старте.
+                # mmap поддерживают только списки IVF; HNSW FAISS читает в память целиком,
+                # и такой индекс сразу доступен для добавления без повторного чтения файла
+                self.index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mmap_source = index_file if faiss.try_extract_index_ivf(self.index) is not None else None
+            except RuntimeError as e:
+                logger.debug(f"Индекс не поддерживает mmap, обычное чтение: {e}")
+                self.index = faiss.read_index(index_file)
+                self._mmap_source = None
+            
+            metadata_path = path.with_suffix('.jsonl')
+            if metadata_path.exists():
+                metadata_map = {}
+                with open(metadata_path, 'rb') as f:
+                    for line in f:
+                        if line.strip():
+                            record = _loads(line)
+                            metadata_map[record['id']] = record['metadata']
+                # Следующий ID берется из самого индекса: ID не переиспользуются, даже если метаданные
+                # последних векторов не были записаны. Метаданные без векторов (сбой между записью
+                # метаданных и индекса) отбрасываются - такие клипы будут обработаны заново
+                next_id = self._next_index_id()
+                orphaned = [video_id for video_id in metadata_map if video_id >= next_id]
+                for video_id in orphaned:
+                    del metadata_map[video_id]
+                if orphaned:
+                    logger.warning(f"Метаданные без векторов в индексе отброшены: {len(orphaned)}")
+                self.metadata_map = metadata_map
+                self.next_id = next_id
+                self._saved_path = metadata_path
+                self._saved_next_id = self.next_id
+            else:
+                # Прежний формат: один JSON-документ; ключи JSON - строки, FAISS возвращает целые ID
+                with open(path.with_suffix('.json'), 'rb') as f:
+                    data = _loads(f.read())
+                self.metadata_map = {int(video_id): metadata for video_id, metadata in data['metadata_map'].items()}
+                self.next_id = max(data['next_id'], self._next_index_id())
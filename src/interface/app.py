@@ -1,8 +1,16 @@
 import gradio as gr
+import os
+import atexit
+import shelve
+import hashlib
 import logging
+import threading
 import numpy as np
 from pathlib import Path
+from typing import Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from src import VideoProcessor, VectorStore, Retriever, MultimodalExtractor, GifGenerator
+from src.config import Config
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,6 +22,8 @@ class VideoRAGApp:
     '''
     Главный класс VideoRAGApp объединяет все компоненты системы и предоставляет веб-интерфейс Gradio.
     '''
+    SUPPORTED_FORMATS = frozenset(Config.SUPPORTED_FORMATS)
+
     def __init__(self, base_dir: Path):
         # Инициализация всех компонентов системы:
         # - VideoProcessor: обработка видео
@@ -30,26 +40,56 @@ class VideoRAGApp:
         logger.info("Инициализация компонентов приложения")
         
         try:
-            self.video_processor = VideoProcessor(base_dir)
-            self.extractor = MultimodalExtractor()
-            self.vector_store = VectorStore(self.extractor.model)
-            self.gif_generator = GifGenerator(base_dir)
+            # Компоненты независимы и загружаются параллельно: время запуска определяет
+            # самый долгий из них (обычно модель ImageBind), а не их сумма
+            with ThreadPoolExecutor(max_workers=4, thread_name_prefix="init") as executor:
+                # Extractor загружает ImageBind лениво; интерфейсу модель нужна сразу для поиска,
+                # поэтому загрузка запускается здесь параллельно с остальными компонентами
+                self.extractor = MultimodalExtractor(
+                    max_concurrent_inference=Config.EXTRACTION_WORKERS,
+                    cache_dir=base_dir / "embeddings", quantize=Config.CPU_INT8, cuda_int8=Config.CUDA_INT8
+                )
+                model_future = executor.submit(self.extractor.load_model)
+                store_future = executor.submit(self._load_vector_store)
+                processor_future = executor.submit(VideoProcessor, base_dir)
+                gif_future = executor.submit(GifGenerator, base_dir)
+                
+                model = model_future.result()
+                self.vector_store, index_loaded = store_future.result()
+                self.video_processor = processor_future.result()
+                self.gif_generator = gif_future.result()
             
-            if self.index_path.with_suffix('.index').exists():
-                logger.info(f"Загрузка существующего индекса: {self.index_path}")
-                try:
-                    self.vector_store.load(self.index_path)
-                    logger.info("Индекс успешно загружен")
-                except Exception as e:
-                    logger.error(f"Ошибка загрузки индекса: {e}")
-                    logger.info("Создание нового индекса")
-            else:
-                logger.info("Существующий индекс не найден. Создание нового индекса")
+            # Чтению индекса модель не нужна; хранилище получает ее после загрузки
+            self.vector_store.model = model
             
             self.retriever = Retriever(self.vector_store)
-            self.processed_videos = set()
+            self._check_embedding_mode(index_loaded)
+            # Обработанные видео хранятся на диске по отпечатку содержимого: после перезапуска
+            # повторная индексация не нужна, а одноименные файлы не путаются.
+            # Значение: имя файла и диапазон ID его клипов в индексе
+            self.processed_videos = shelve.open(str(base_dir / "processed"))
+            self._processed_lock = threading.Lock()
+            # Фоновые задачи обработки видео: ключ содержимого -> (future, прогресс)
+            self.executor = ThreadPoolExecutor(max_workers=Config.MAX_WORKERS, thread_name_prefix="video-job")
+            self._jobs = {}
+            self._jobs_lock = threading.Lock()
+            atexit.register(self.processed_videos.close)
+            if not index_loaded:
+                # Без индекса записи об обработке недействительны
+                self.processed_videos.clear()
+            else:
+                self._drop_unsaved_videos()
             
-            self.gif_generator.cleanup_old_gifs(max_age_hours=24)
+            # Индекс сохраняется в фоне раз в INDEX_SAVE_EVERY обработанных видео, а не после каждого:
+            # пользователь не ждет записи на диск. Один поток - не больше одного сохранения за раз;
+            # несохраненный остаток записывается при завершении приложения
+            self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-save")
+            self._save_lock = threading.Lock()
+            self._unsaved_videos = 0
+            atexit.register(self._flush_index)
+            
+            # Очистка старых GIF не блокирует запуск: первый проход сразу в фоне, далее раз в час
+            self._schedule_gif_cleanup(delay=0)
             
             logger.info("Приложение успешно инициализировано")
             
@@ -57,146 +97,376 @@ class VideoRAGApp:
             logger.exception("Ошибка инициализации приложения")
             raise
 
-    def process_video_only(self, video_path: str) -> str:
+    def _schedule_gif_cleanup(self, delay: float) -> None:
+        self._cleanup_timer = threading.Timer(delay, self._periodic_gif_cleanup)
+        self._cleanup_timer.daemon = True
+        self._cleanup_timer.start()
+
+    def _periodic_gif_cleanup(self) -> None:
+        try:
+            self.gif_generator.cleanup_old_gifs(max_age_hours=24)
+        finally:
+            self._schedule_gif_cleanup(delay=3600)
+
+    def _check_embedding_mode(self, index_loaded: bool) -> None:
+        # Индекс помечается режимом модели (fp32/int8), в котором построен: векторы клипов
+        # и запросов из разных режимов сравнимы лишь приближенно
+        mode_path = self.index_path.with_suffix('.mode')
+        mode = self.extractor.embedding_mode
+        if index_loaded and mode_path.exists():
+            index_mode = mode_path.read_text().strip()
+            if index_mode != mode:
+                logger.warning(f"Индекс построен в режиме {index_mode}, а модель работает в режиме {mode}: "
+                               f"результаты поиска будут менее точными. Верните прежний режим "
+                               f"(VIDEO_RAG_CPU_INT8/VIDEO_RAG_CUDA_INT8) или постройте индекс заново")
+            return
+        
+        if index_loaded:
+            logger.warning(f"Режим модели для существующего индекса не записан, принимается текущий: {mode}")
+        mode_path.parent.mkdir(parents=True, exist_ok=True)
+        mode_path.write_text(mode)
+
+    def _drop_unsaved_videos(self) -> None:
+        # Сохранение индекса отложенное: видео, клипы которых не попали в сохраненный индекс
+        # (приложение было прервано до записи), считаются необработанными
+        with self._processed_lock:
+            stale = [
+                key for key, record in self.processed_videos.items()
+                if record.get('first_id', 0) + record.get('count', 0) > self.vector_store.next_id
+            ]
+            for key in stale:
+                del self.processed_videos[key]
+        if stale:
+            logger.warning(f"Видео без сохраненного индекса будут обработаны заново: {len(stale)}")
+
+    def _index_changed(self) -> None:
+        with self._save_lock:
+            self._unsaved_videos += 1
+            if self._unsaved_videos < Config.INDEX_SAVE_EVERY:
+                return
+            pending, self._unsaved_videos = self._unsaved_videos, 0
+        try:
+            self._save_executor.submit(self._save_index, pending)
+        except RuntimeError:
+            # Пул уже остановлен (завершение интерпретатора): сохранение в текущем потоке
+            self._save_index(pending)
+
+    def _save_index(self, pending: int) -> bool:
+        try:
+            self.vector_store.upgrade_index()
+            self.vector_store.save(self.index_path)
+            logger.info(f"Индекс векторного хранилища сохранен: {self.index_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения индекса: {e}")
+            # Следующее обработанное видео повторит сохранение
+            with self._save_lock:
+                self._unsaved_videos += max(pending, Config.INDEX_SAVE_EVERY - 1)
+            return False
+
+    def _flush_index(self) -> None:
+        # concurrent.futures останавливает свои пулы раньше обработчиков atexit (Python 3.9+),
+        # поэтому остаток сохраняется синхронно: сначала дожидаемся фонового сохранения, если оно идет
+        self._save_executor.shutdown(wait=True)
+        with self._save_lock:
+            pending, self._unsaved_videos = self._unsaved_videos, 0
+        if pending:
+            self._save_index(pending)
+
+    def _load_vector_store(self):
+        vector_store = VectorStore(None)
+        if not self.index_path.with_suffix('.index').exists():
+            logger.info("Существующий индекс не найден. Создание нового индекса")
+            return vector_store, False
+        
+        logger.info(f"Загрузка существующего индекса: {self.index_path}")
+        try:
+            vector_store.load(self.index_path)
+            logger.info("Индекс успешно загружен")
+            return vector_store, True
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индекса: {e}")
+            logger.info("Создание нового индекса")
+            return VectorStore(None), False
+
+    def process_video_only(self, video_path: str) -> Iterator[str]:
         # Полная обработка видео:
         # 1. Валидация формата
         # 2. Разделение на клипы
         # 3. Извлечение признаков из каждого клипа
         # 4. Индексирование в векторном хранилище
         # 5. Сохранение индекса
+        # Обработка идет в пуле приложения, а обработчик Gradio только передает статус:
+        # интерфейс не блокируется, и несколько видео обрабатываются одновременно
         try:
-            if not video_path or not Path(video_path).exists():
+            path = self._validate_video(video_path)
+            if path is None:
                 logger.warning("Недопустимый видео файл")
-                return "❌ Пожалуйста, загрузите корректный видео файл"
+                yield "❌ Пожалуйста, загрузите корректный видео файл"
+                return
             
-            video_name = Path(video_path).name
-            if video_name in self.processed_videos:
+            video_name = path.name
+            video_key = self._video_fingerprint(video_path)
+            if self._is_processed(video_key):
                 logger.info(f"Видео '{video_name}' уже обработано")
-                return f"✅ Видео '{video_name}' уже обработано"
+                yield f"✅ Видео '{video_name}' уже обработано"
+                return
             
             logger.info(f"Обработка видео: {video_name}")
             
-            supported_formats = ['.mp4', '.avi', '.mov', '.mkv']
-            if not any(video_name.lower().endswith(fmt) for fmt in supported_formats):
-                return f"❌ Неподдерживаемый формат видео. Поддерживаемые: {', '.join(supported_formats)}"
+            if path.suffix.lower() not in self.SUPPORTED_FORMATS:
+                yield f"❌ Неподдерживаемый формат видео. Поддерживаемые: {', '.join(Config.SUPPORTED_FORMATS)}"
+                return
+            
+            with self._jobs_lock:
+                # Повторная загрузка того же видео во время обработки ждет уже запущенную задачу.
+                # Задача снимается из _jobs после записи в processed_videos, поэтому повторная
+                # проверка под блокировкой исключает вторую индексацию завершившегося видео
+                job = self._jobs.get(video_key)
+                already_processed = job is None and self._is_processed(video_key)
+                if job is None and not already_processed:
+                    progress = {'clips': 0}
+                    future = self.executor.submit(self._process_video_job, video_key, video_name, video_path, progress)
+                    job = self._jobs[video_key] = (future, progress)
+            
+            if already_processed:
+                logger.info(f"Видео '{video_name}' уже обработано")
+                yield f"✅ Видео '{video_name}' уже обработано"
+                return
             
-            success = self._process_video_internal(video_path)
+            future, progress = job
+            while True:
+                try:
+                    success = future.result(timeout=1.0)
+                    break
+                except FuturesTimeoutError:
+                    yield f"⏳ Обработка видео '{video_name}': нарезано клипов {progress['clips']}"
             
             if success:
-                self.processed_videos.add(video_name)
                 logger.info(f"Видео '{video_name}' успешно обработано")
-                return f"✅ Видео '{video_name}' успешно обработано! Теперь можно выполнять поиск."
+                yield f"✅ Видео '{video_name}' успешно обработано! Теперь можно выполнять поиск."
             else:
-                return f"❌ Ошибка обработки видео '{video_name}'. Проверьте логи для деталей."
+                yield f"❌ Ошибка обработки видео '{video_name}'. Проверьте логи для деталей."
                 
         except Exception as e:
             logger.exception(f"Ошибка обработки для {video_path}: {str(e)}")
-            return f"❌ Ошибка обработки видео: {str(e)}"
+            yield f"❌ Ошибка обработки видео: {str(e)}"
+
+    def _process_video_job(self, video_key: str, video_name: str, video_path: str, progress: dict) -> bool:
+        try:
+            success = self._process_video_internal(video_path, progress, video_key)
+            if success:
+                with self._processed_lock:
+                    self.processed_videos[video_key] = {'name': video_name, **progress.get('index_range', {})}
+                    self.processed_videos.sync()
+            return success
+        finally:
+            with self._jobs_lock:
+                self._jobs.pop(video_key, None)
 
-    def _process_video_internal(self, video_path: str) -> bool:
+    @staticmethod
+    def _validate_video(video_path: str) -> Optional[Path]:
+        # Один объект Path и один stat на проверку; None - файла нет или это не файл
+        if not video_path:
+            return None
+        path = Path(video_path)
+        return path if path.is_file() else None
+
+    @staticmethod
+    def _video_fingerprint(video_path: str, sample_size: int = 1 << 19) -> str:
+        # SHA-1 по началу и концу файла (по 512 КБ) и размер: в MP4/MOV индекс moov
+        # часто лежит в конце, поэтому одного начала файла недостаточно
+        with open(video_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            digest = hashlib.sha1(f.read(sample_size))
+            if size > 2 * sample_size:
+                f.seek(-sample_size, os.SEEK_END)
+            digest.update(f.read(sample_size))
+        return f"{digest.hexdigest()}_{size}"
+
+    def _is_processed(self, video_key: str) -> bool:
+        with self._processed_lock:
+            return video_key in self.processed_videos
+
+    def _process_video_internal(self, video_path: str, progress: dict = None, video_key: str = None) -> bool:
         try:
-            clips_info = self.video_processor.process_video(video_path)
+            # Клипы приходят по мере нарезки и сразу отправляются на извлечение признаков:
+            # декодирование и инференс нескольких клипов идут параллельно, пока FFmpeg режет следующие.
+            # Потоки используют одну загруженную модель; пул процессов копировал бы ее в каждый процесс
+            # Клипы собираются в пакеты по EXTRACTION_BATCH_SIZE: один проход модели на пакет
+            clips_count = 0
+            # Эмбеддинги пишутся прямо в общий буфер по строке на клип; размер задает верхняя
+            # граница числа клипов, известная после пробинга (результат кэширован).
+            # Буфер в float32, который принимает FAISS: непрерывный срез уходит в индекс без копии,
+            # а FP16-результаты extractor приводятся к float32 при записи в строки буфера
+            capacity = self.video_processor.max_clip_count(video_path)
+            embedding_buffer = np.empty((capacity, self.vector_store.dimension), dtype=np.float32)
+            batch_size = max(1, Config.EXTRACTION_BATCH_SIZE)
+            with ThreadPoolExecutor(max_workers=Config.DECODE_WORKERS,
+                                    thread_name_prefix="extract") as executor:
+                futures = []
+                pending = []
+                
+                def submit_pending():
+                    first_row = clips_count - len(pending)
+                    end_row = clips_count
+                    futures.append(executor.submit(
+                        self._extract_clips, video_path, list(pending),
+                        embedding_buffer[first_row:end_row] if end_row <= capacity else None
+                    ))
+                    pending.clear()
+                
+                for clip_video_path, clip_audio_path in self.video_processor.process_video(video_path, clip_id=video_key):
+                    clips_count += 1
+                    if progress is not None:
+                        progress['clips'] = clips_count
+                    pending.append((clip_video_path, clip_audio_path))
+                    if len(pending) == batch_size:
+                        submit_pending()
+                if pending:
+                    submit_pending()
+                
+                # Эмбеддинги копятся в порядке клипов и добавляются в индекс одним пакетом
+                clips = [
+                    (row, clip)
+                    for row, clip in enumerate(clip for future in futures for clip in future.result())
+                    if clip
+                ]
             
-            if not clips_info:
+            if clips_count == 0:
                 logger.error("Не создано ни одного клипа из видео")
                 return False
-                
-            logger.info(f"Обработка {len(clips_info)} клипов")
-            
-            processed_count = 0
-            
-            for clip_video_path, clip_audio_path in clips_info:
-                try:
-                    logger.debug(f"Извлечение признаков из клипа: {clip_video_path}")
-                    
-                    if not Path(clip_video_path).exists():
-                        logger.error(f"Файл клипа не найден: {clip_video_path}")
-                        continue
-                    
-                    features = self.extractor.extract_features(clip_video_path)
-                    
-                    if features['embeddings'] is None or np.all(features['embeddings'] == 0):
-                        logger.warning(f"Пустые эмбеддинги для клипа: {clip_video_path}")
-                        continue
-                    
-                    metadata = {
-                        'source_video': Path(video_path).name,
-                        'clip_path': clip_video_path,
-                        'audio_path': clip_audio_path,
-                        'start_time': features['start_time'],
-                        'end_time': features['end_time'],
-                        'transcript': features.get('transcript', ''),
-                        'visual_description': features.get('visual_description', '')
-                    }
-                    
-                    self.vector_store.add_video(
-                        clip_video_path,
-                        metadata,
-                        features['embeddings']
-                    )
-                    
-                    processed_count += 1
-                    logger.debug(f"Клип добавлен в векторное хранилище: {clip_video_path}")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка обработки клипа {clip_video_path}: {e}")
-                    continue
             
+            processed_count = len(clips)
             if processed_count == 0:
                 logger.error("Ни один клип не был успешно обработан")
                 return False
             
-            try:
-                self.vector_store.save(self.index_path)
-                logger.info(f"Индекс векторного хранилища сохранен: {self.index_path}")
-            except Exception as e:
-                logger.error(f"Ошибка сохранения индекса: {e}")
-                return False
+            rows = [row for row, _ in clips]
+            batch_metadata = [metadata for _, (_, metadata) in clips]
+            if rows[-1] < capacity:
+                # Без пропущенных клипов пакет - срез буфера без копирования
+                batch_embeddings = embedding_buffer[:processed_count] if rows[-1] == processed_count - 1 else embedding_buffer[rows]
+            else:
+                batch_embeddings = np.vstack([embeddings for _, (embeddings, _) in clips])
+            ids = self.vector_store.add_videos(batch_metadata, batch_embeddings)
+            if progress is not None:
+                progress['index_range'] = {'first_id': ids[0], 'count': len(ids)}
+            logger.debug(f"Клипов добавлено в векторное хранилище: {processed_count}")
             
-            logger.info(f"Успешно обработано клипов: {processed_count}/{len(clips_info)}")
+            self._index_changed()
+            
+            logger.info(f"Успешно обработано клипов: {processed_count}/{clips_count}")
             return True
             
         except Exception as e:
             logger.exception(f"Внутренняя ошибка обработки: {e}")
             return False
 
-    def search_video(self, video_path: str, query: str) -> tuple[str, str, list]:
+    def _extract_clips(self, video_path: str, clip_paths: list, out: np.ndarray = None) -> list:
+        # Возвращает по клипу пакета (эмбеддинг, метаданные) или None, если клип пропущен.
+        # out - строки общего буфера, в которые записываются эмбеддинги пакета
+        try:
+            # Один stat на клип, без промежуточных объектов Path
+            existing = []
+            for row, (clip_video_path, _) in enumerate(clip_paths):
+                if os.path.isfile(clip_video_path):
+                    existing.append(row)
+                else:
+                    logger.error(f"Файл клипа не найден: {clip_video_path}")
+            
+            source_video = os.path.basename(video_path)
+            results = [None] * len(clip_paths)
+            if not existing:
+                return results
+            
+            logger.debug(f"Извлечение признаков из клипов: {len(existing)}")
+            # Без пропусков пакет пишется прямо в строки буфера, иначе - в отдельный массив
+            batch_out = out if out is not None and len(existing) == len(clip_paths) else None
+            # Лимит на проход модели общий для всех видео и действует внутри extractor:
+            # память модели (в т.ч. GPU) одна, а декодирование пакетов идет параллельно
+            features_list = self.extractor.extract_features_batch(
+                [clip_paths[row][0] for row in existing], out=batch_out
+            )
+            
+            for row, features in zip(existing, features_list):
+                clip_video_path, clip_audio_path = clip_paths[row]
+                embeddings = features['embeddings']
+                # Флаг extractor вместо проверки всех 1024 значений на ноль
+                if embeddings is None or not features.get('valid', True):
+                    logger.warning(f"Пустые эмбеддинги для клипа: {clip_video_path}")
+                    continue
+                if out is not None and batch_out is None:
+                    out[row] = embeddings
+                
+                clip_start, _ = self.video_processor.clip_time_range(clip_video_path)
+                metadata = {
+                    'source_video': source_video,
+                    'source_path': video_path,
+                    'clip_path': clip_video_path,
+                    'clip_start': clip_start,
+                    'audio_path': clip_audio_path,
+                    'start_time': features['start_time'],
+                    'end_time': features['end_time'],
+                    'transcript': features.get('transcript', ''),
+                    'visual_description': features.get('visual_description', '')
+                }
+                results[row] = (embeddings, metadata)
+            
+            logger.debug(f"Признаки клипов подготовлены: {len(existing)}")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Ошибка обработки клипов {[path for path, _ in clip_paths]}: {e}")
+            return [None] * len(clip_paths)
+
+    def search_video(self, video_path: str, query: str) -> Iterator[list]:
         # Поиск и генерация ответа:
         # 1. Поиск релевантных клипов
         # 2. Создание GIF-превью
         # 3. Генерация текстового ответа
         # 4. Форматирование результатов для UI
+        # Галерея обновляется по мере готовности GIF, в порядке релевантности
         try:
-            if not video_path or not Path(video_path).exists():
+            path = self._validate_video(video_path)
+            if path is None:
                 logger.warning("Поиск вызван без видео")
-                return "❌ Пожалуйста, загрузите и обработайте видео сначала", "", []
+                yield "❌ Пожалуйста, загрузите и обработайте видео сначала", "", []
+                return
             
             if not query.strip():
                 logger.warning("Поиск вызван без запроса")
-                return "❌ Пожалуйста, введите вопрос", "", []
+                yield "❌ Пожалуйста, введите вопрос", "", []
+                return
             
-            video_name = Path(video_path).name
-            if video_name not in self.processed_videos:
+            video_name = path.name
+            if not self._is_processed(self._video_fingerprint(video_path)):
                 logger.warning(f"Попытка поиска по необработанному видео: {video_name}")
-                return f"❌ Видео '{video_name}' не обработано. Пожалуйста, обработайте его сначала.", "", []
+                yield f"❌ Видео '{video_name}' не обработано. Пожалуйста, обработайте его сначала.", "", []
+                return
             
             logger.info(f"Поиск: '{query}' в видео: {video_name}")
             
             results = self.retriever.search(query, top_k=3)
             
             if not results:
-                return "❌ Релевантные клипы не найдены. Попробуйте перефразировать вопрос.", "", []
-            
-            gif_info = self.gif_generator.create_gifs_from_results(results, max_gifs=3)
+                yield "❌ Релевантные клипы не найдены. Попробуйте перефразировать вопрос.", "", []
+                return
             
-            gif_paths = [info['gif_path'] for info in gif_info if Path(info['gif_path']).exists()]
+            ready = {}
+            # Клипы из сохраненного индекса могли не пережить перезапуск (tmpfs, очистка каталога):
+            # генератор проверяет их наличие и при необходимости берет кадры из исходного видео
+            for i, info in self.gif_generator.iter_gifs_from_results(results, max_gifs=3):
+                ready[i] = info['gif_path']
+                yield [ready[rank] for rank in sorted(ready)]
             
-            logger.info(f"Поиск завершен: найдено {len(results)} результатов, создано {len(gif_paths)} GIF")
-            return gif_paths
+            logger.info(f"Поиск завершен: найдено {len(results)} результатов, создано {len(ready)} GIF")
+            if not ready:
+                yield []
             
         except Exception as e:
             logger.exception(f"Ошибка поиска: {str(e)}")
-            return f"❌ Ошибка поиска: {str(e)}", "", []
+            yield f"❌ Ошибка поиска: {str(e)}", "", []
 
 def launch_app():
     base_dir = Path("processed_data")
@@ -288,22 +558,37 @@ def launch_app():
         process_btn.click(
             fn=app.process_video_only,
             inputs=[video_input],
-            outputs=[process_status]
+            outputs=[process_status],
+            api_name="process",
+            queue=True,
+            # Обработчик только ожидает фоновую задачу, поэтому одновременных вызовов может быть несколько
+            concurrency_limit=Config.MAX_WORKERS
         )
         
+        # Генератор search_video обновляет галерею по мере готовности GIF; нужна очередь Gradio
         search_btn.click(
             fn=app.search_video,
             inputs=[video_input, query],
-            outputs=[gif_gallery]
+            outputs=[gif_gallery],
+            api_name="search",
+            queue=True,
+            # Запросы выполняются параллельно: кодирование запроса и GIF - вне блокировки хранилища,
+            # под ней только вызов FAISS; сохранение и перестроение индекса держат ее лишь для снимка и подмены
+            concurrency_limit=Config.MAX_WORKERS
         )
     
+    # Лимит одновременных вызовов по умолчанию (в Gradio он равен 1) и размер очереди ожидания
+    demo.queue(default_concurrency_limit=Config.MAX_WORKERS, max_size=64)
+    
     try:
         demo.launch(
             server_name="localhost",
             server_port=7860,
             inbrowser=True,
             share=False,
-            show_error=True
+            show_error=True,
+            # GIF могут лежать вне рабочего каталога (например, на RAM-диске)
+            allowed_paths=[str(app.gif_generator.gif_dir)]
         )
     except Exception as e:
         logger.exception("Ошибка запуска Gradio приложения")
@@ -1,163 +1,584 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import torch
-from imagebind.models import imagebind_model
+import torch.nn.functional as F
 from imagebind.models.imagebind_model import ModalityType
 from imagebind import data
+from pytorchvideo.data.clip_sampling import ConstantClipsPerVideoSampler
+from torchvision import transforms
+from torchvision.transforms._transforms_video import NormalizeVideo
+from pytorchvideo import transforms as pv_transforms
 from pathlib import Path
+import os
+import hashlib
+import contextlib
+from functools import lru_cache
 import logging
+import threading
 import av
-import tempfile
 import subprocess
 import numpy as np
 
+from ..utils.model_loader import get_imagebind, bnb
+from ..utils.subprocess_runner import FFMPEG_CMD
+
+try:
+    from torchcodec.decoders import VideoDecoder
+except ImportError:
+    VideoDecoder = None
+
 logger = logging.getLogger(__name__)
 
+def _container_duration(container) -> float:
+    video_stream = next(s for s in container.streams if s.type == 'video')
+    return float(video_stream.duration * video_stream.time_base)
+
+@lru_cache(maxsize=4096)
+def _probe_duration(video_path: str, mtime_ns: int, size: int) -> float:
+    # mtime и размер входят в ключ кэша: перезаписанный клип будет открыт заново
+    with av.open(video_path) as container:
+        return _container_duration(container)
+
 class MultimodalExtractor:
     '''
     Класс MultimodalExtractor извлекает мультимодальные признаки (визуальные + аудио) из видеоклипов с помощью модели ImageBind.
     '''
-    def __init__(self, device: str = "cpu"):
+    AUDIO_SAMPLE_RATE = 16000
+    EMB_DIM = 1024
+    EMBEDDING_DTYPE = np.float16
+    # Общий нулевой вектор для клипов без признаков (только для чтения): вызывающий код копирует
+    # его в свой буфер, а перед изменением на месте должен вызвать .copy()
+    EMPTY_EMBEDDING = np.zeros(EMB_DIM, dtype=EMBEDDING_DTYPE)
+    EMPTY_EMBEDDING.setflags(write=False)
+    # Не больше стольких CUDA-графов (разных форм пакета) со своими статическими буферами
+    MAX_CUDA_GRAPHS = 8
+    # Границы диапазонов признаков и их категории для текстового описания клипа
+    FEATURE_BINS = np.array([256, 512, 768])
+    FEATURE_CATEGORIES = ("Сцена/Фон", "Объекты/Люди", "Движение/Действие", "Визуальные эффекты")
+
+    def __init__(self, device: str = "cpu", max_concurrent_inference: int = 1, cache_dir: Path = None,
+                 compile_model: bool = True, quantize: bool = False, cuda_graphs: bool = True,
+                 cuda_int8: bool = False):
         self.device = device
+        # int8-квантование линейных слоев включается явно: динамическое на CPU при quantize=True,
+        # на GPU - через bitsandbytes при cuda_int8=True (и установленном bitsandbytes)
+        if quantize and str(device) == "cpu":
+            self.quantization = "dynamic"
+        elif cuda_int8 and str(device).startswith("cuda") and bnb is not None:
+            self.quantization = "bnb"
+        else:
+            self.quantization = None
+        # Квантованная модель дает немного другие эмбеддинги: режим задает каталог кэша
+        # и сверяется с режимом, в котором построен индекс
+        self.embedding_mode = {"dynamic": "int8", "bnb": "int8-cuda"}.get(self.quantization, "fp32")
+        # Кэш эмбеддингов клипов по хэшу содержимого: повторная обработка тех же клипов
+        # (в том числе после перезапуска) обходится без модели
+        self.cache_dir = cache_dir / self.embedding_mode if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Декодирование клипов идет в потоках вызывающего кода без ограничений (PyAV и FFmpeg
+        # отпускают GIL), а лимит действует только на проход модели: пока модель считает
+        # один пакет, следующие уже декодируются
+        self._inference_slots = threading.BoundedSemaphore(max_concurrent_inference)
+        self._max_concurrent_inference = max_concurrent_inference
+        # Тензоры готовятся на CPU; для CUDA они закрепляются в памяти и копируются асинхронно
+        self._pin_memory = str(device).startswith("cuda")
+        # На GPU с поддержкой bfloat16 проход выполняется под autocast: матричные умножения
+        # на тензорных ядрах в bf16, веса и нормализации остаются в FP32
+        self._autocast_dtype = (
+            torch.bfloat16
+            if self._pin_memory and torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+            else None
+        )
         logger.info(f"Инициализация MultimodalExtractor на устройстве: {device}")
         
-        self.model = imagebind_model.imagebind_huge(pretrained=True)
-        self.model.eval().to(self.device)
-        self.model.device = self.device
-        logger.info("Модель ImageBind загружена")
-
-    def extract_features(self, video_path: str) -> Dict[str, Any]:
-        # 1. Загружает и преобразует видеоданные для модели ImageBind
-        # 2. Извлекает аудио во временный файл при наличии
-        # 3. Получает эмбеддинги для визуальной и аудио модальностей
-        # 4. Комбинирует эмбеддинги (среднее арифметическое)
-        # 5. Возвращает 1024-мерный вектор признаков
+        # Веса ImageBind (загрузка, квантование, компиляция) готовятся при первом обращении
+        # к модели: создание extractor ничего не скачивает и не занимает память устройства
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._compile = compile_model
+        self._cuda_graphs = cuda_graphs
+        self._use_cuda_graphs = False
+        self._forward = None
+        # Без torch.compile (PyTorch 1.13) проход на GPU записывается в CUDA-граф вручную:
+        # по графу на форму входов, повтор графа вместо запуска каждого ядра
+        self._graphs = {}
+        self._graphs_lock = threading.Lock()
+        # Записи графов идут по одной; _graphs_lock защищает только словарь графов
+        self._capture_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_model()
+        return self._model
+
+    def load_model(self):
+        # Потокобезопасная однократная подготовка модели; self._model публикуется последним,
+        # чтобы другие потоки не увидели модель без готового прохода _forward
+        with self._model_lock:
+            if self._model is not None:
+                return self._model
+            
+            # Одна копия весов на процесс: повторное создание extractor не загружает модель заново
+            model = get_imagebind(self.device, quantization=self.quantization)
+            
+            # Проход извлечения признаков компилируется (PyTorch 2.0+), self.model остается обычным
+            # модулем для текстовых запросов Retriever
+            forward = self._compile_model(model) if self._compile else model
+            # Ядра bitsandbytes выполняют часть логики на CPU и в CUDA-граф не записываются
+            if self._cuda_graphs and self._pin_memory and forward is model and self.quantization != "bnb":
+                self._use_cuda_graphs = True
+                forward = self._graphed_forward
+            
+            self._forward = forward
+            self._model = model
+            return model
+
+    def _compile_model(self, model):
+        if not hasattr(torch, "compile"):
+            logger.debug(f"torch.compile недоступен в PyTorch {torch.__version__}")
+            return model
+        
+        try:
+            # На GPU max-autotune подбирает ядра и использует CUDA-графы, снимая накладные расходы
+            # запуска ядер; на CPU автотюнинг не дает выигрыша
+            mode = "max-autotune" if self._pin_memory else "default"
+            forward = torch.compile(model, mode=mode, fullgraph=False)
+            # Первый вызов компилирует граф: прогрев при запуске, а не на первом видео пользователя.
+            # Формы входов совпадают с data.load_and_transform_video_data/audio_data для одного клипа
+            with torch.inference_mode(), self._autocast():
+                forward({
+                    ModalityType.VISION: torch.zeros(1, 15, 3, 2, 224, 224, device=self.device),
+                    ModalityType.AUDIO: torch.zeros(1, 3, 1, 128, 204, device=self.device),
+                })
+            logger.info(f"Модель ImageBind скомпилирована (mode={mode})")
+            return forward
+        except Exception as e:
+            logger.warning(f"Ошибка компиляции модели, используется обычный режим: {e}")
+            return model
+
+    @staticmethod
+    def _graph_key(inputs: Dict) -> tuple:
+        return tuple((modality, tuple(tensor.shape), tensor.dtype) for modality, tensor in sorted(inputs.items()))
+
+    def _ensure_graph(self, inputs: Dict) -> None:
+        # Во время записи CUDA-графа любая другая работа на GPU (проход, синхронизация) запрещена.
+        # Поэтому граф новой формы записывается до входа в проход, пока поток не занимает слот,
+        # а сама запись занимает все слоты инференса: остальные проходы ждут ее окончания
+        key = self._graph_key(inputs)
+        with self._graphs_lock:
+            if key in self._graphs or len(self._graphs) >= self.MAX_CUDA_GRAPHS:
+                return
+        
+        with self._capture_lock:
+            with self._graphs_lock:
+                if key in self._graphs or len(self._graphs) >= self.MAX_CUDA_GRAPHS:
+                    return
+            
+            acquired = 0
+            try:
+                for _ in range(self._max_concurrent_inference):
+                    self._inference_slots.acquire()
+                    acquired += 1
+                with torch.inference_mode(), self._autocast():
+                    entry = self._capture_graph({
+                        modality: self._to_device(tensor) for modality, tensor in inputs.items()
+                    })
+            finally:
+                for _ in range(acquired):
+                    self._inference_slots.release()
+            
+            with self._graphs_lock:
+                # Неудачная запись сохраняется как None и не повторяется
+                self._graphs[key] = entry
+
+    def _graphed_forward(self, inputs: Dict) -> Dict:
+        with self._graphs_lock:
+            entry = self._graphs.get(self._graph_key(inputs))
+        if entry is None:
+            # Форм больше лимита (память под статические буферы) или запись не удалась
+            return self.model(inputs)
+        
+        graph, static_inputs, static_outputs, lock = entry
+        # Статические буферы графа общие: одновременные проходы одной формы идут по очереди
+        with lock:
+            for modality, tensor in inputs.items():
+                static_inputs[modality].copy_(tensor, non_blocking=True)
+            graph.replay()
+            return {modality: output.clone() for modality, output in static_outputs.items()}
+
+    def _capture_graph(self, inputs: Dict):
+        try:
+            static_inputs = {modality: tensor.clone() for modality, tensor in inputs.items()}
+            # Прогрев на отдельном потоке CUDA перед записью, как требует torch.cuda.graph
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    self.model(static_inputs)
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_outputs = self.model(static_inputs)
+            logger.info(f"Записан CUDA-граф для входов: {[tuple(t.shape) for t in inputs.values()]}")
+            return graph, static_inputs, static_outputs, threading.Lock()
+        except Exception as e:
+            logger.warning(f"Ошибка записи CUDA-графа, используется обычный проход: {e}")
+            return None
+
+    def extract_features(self, video_path: str, out: np.ndarray = None) -> Dict[str, Any]:
+        # Извлечение признаков одного клипа; out - необязательная строка буфера (float16 или float32)
+        # вызывающего кода, куда записывается результат
+        return self.extract_features_batch([video_path], out=None if out is None else out.reshape(1, -1))[0]
+
+    def extract_features_batch(self, video_paths: List[str], out: np.ndarray = None) -> List[Dict[str, Any]]:
+        # Признаки пакета клипов с дисковым кэшем: клипы, эмбеддинг которых уже сохранен
+        # по хэшу содержимого, в проход модели не попадают
+        if self.cache_dir is None:
+            return self._extract_features_batch(video_paths, out)
+        
+        keys = [self._cache_key(path) for path in video_paths]
+        results = [None] * len(video_paths)
+        misses = []
+        for row, (path, key) in enumerate(zip(video_paths, keys)):
+            cached = self._load_cached_embedding(key)
+            if cached is None:
+                misses.append(row)
+                continue
+            embeddings = out[row] if out is not None else np.empty(self.EMB_DIM, dtype=self.EMBEDDING_DTYPE)
+            embeddings[:] = cached
+            results[row] = {
+                "embeddings": embeddings,
+                "start_time": 0.0,
+                "end_time": self._get_video_duration(path),
+                "transcript": "",
+                "visual_description": self._generate_visual_description(embeddings),
+                "valid": True
+            }
+        
+        if len(misses) < len(video_paths):
+            logger.debug(f"Эмбеддинги из кэша: {len(video_paths) - len(misses)}/{len(video_paths)}")
+        if not misses:
+            return results
+        
+        # Без попаданий в кэш результаты пишутся прямо в out, иначе - во временный буфер
+        miss_out = out if out is not None and len(misses) == len(video_paths) else None
+        features_list = self._extract_features_batch([video_paths[row] for row in misses], miss_out)
+        for row, features in zip(misses, features_list):
+            embeddings = features['embeddings']
+            if out is not None and miss_out is None:
+                out[row] = embeddings
+                features['embeddings'] = out[row]
+            if features['valid']:
+                self._save_cached_embedding(keys[row], embeddings)
+            results[row] = features
+        return results
+
+    def _extract_features_batch(self, video_paths: List[str], out: np.ndarray = None) -> List[Dict[str, Any]]:
+        # 1. Загружает и преобразует видеоданные всех клипов одним пакетом
+        # 2. Извлекает аудио клипов, в которых оно есть
+        # 3. Получает эмбеддинги обеих модальностей за один проход модели
+        # 4. Комбинирует эмбеддинги (среднее арифметическое) для клипов с аудио
+        # 5. Возвращает по 1024-мерному вектору признаков на клип, в порядке video_paths;
+        #    valid=False - признаки не получены, вектор нулевой
+        # out - необязательный буфер float16 или float32 формы (len(video_paths), 1024) для результатов.
+        # Эмбеддинги хранятся в FP16: вдвое меньше памяти, записей кэша и данных для индекса,
+        # который сам хранит векторы в FP16; сложение модальностей выполняется в float32 на устройстве
         try:
-            logger.info(f"Извлечение признаков из: {video_path}")
+            logger.info(f"Извлечение признаков из клипов: {len(video_paths)}")
             
-            duration = self._get_video_duration(video_path)
-            logger.debug(f"Длительность видео: {duration:.2f} секунд")
+            # Аудио есть не у всех клипов: модальности обрабатываются моделью независимо,
+            # поэтому пакет аудио может быть короче пакета видео; audio_rows сопоставляет строки
+            durations, audio_rows, audio_clips = [], [], []
+            for row, path in enumerate(video_paths):
+                duration, audio_clip = self._load_clip_audio(path, "cpu")
+                durations.append(duration)
+                if audio_clip is not None:
+                    audio_rows.append(row)
+                    audio_clips.append(audio_clip)
             
             inputs = {}
             
             try:
-                video_input = data.load_and_transform_video_data([video_path], self.device)
-                inputs[ModalityType.VISION] = video_input
+                inputs[ModalityType.VISION] = self._load_video_inputs(video_paths)
                 logger.debug("Видео данные успешно загружены")
             except Exception as e:
+                if len(video_paths) > 1:
+                    # Один поврежденный клип не должен лишать признаков весь пакет
+                    logger.warning(f"Ошибка пакетной загрузки видео, поклиповая обработка: {e}")
+                    return [
+                        self.extract_features(path, out=None if out is None else out[row])
+                        for row, path in enumerate(video_paths)
+                    ]
                 logger.error(f"Ошибка загрузки видео данных: {e}")
-                return self._create_empty_features(duration)
+                return [self._create_empty_features(durations[0])]
             
-            audio_path = None
-            if self._has_audio(video_path):
-                try:
-                    audio_path = self._extract_audio(video_path)
-                    if audio_path:
-                        audio_input = data.load_and_transform_audio_data([audio_path], self.device)
-                        inputs[ModalityType.AUDIO] = audio_input
-                        logger.debug("Аудио данные успешно загружены")
-                except Exception as e:
-                    logger.warning(f"Ошибка загрузки аудио данных: {e}")
+            if audio_clips:
+                inputs[ModalityType.AUDIO] = torch.stack(audio_clips, dim=0)
+                logger.debug("Аудио данные успешно загружены")
             
-            with torch.no_grad():
-                embeddings = self.model(inputs)
+            # Первый пакет загружает модель, последующие используют готовую
+            if self._model is None:
+                self.load_model()
+            if self._use_cuda_graphs:
+                self._ensure_graph(inputs)
+            with self._inference_slots, torch.inference_mode(), self._autocast():
+                embeddings = self._forward({
+                    modality: self._to_device(tensor) for modality, tensor in inputs.items()
+                })
+                embeddings = self._fit_embeddings(embeddings)
                 
-                visual_emb = self._extract_safe_embedding(embeddings, ModalityType.VISION)
-                audio_emb = self._extract_safe_embedding(embeddings, ModalityType.AUDIO)
+                visual_emb = self._extract_safe_embeddings(embeddings, ModalityType.VISION, len(video_paths))
+                audio_emb = self._extract_safe_embeddings(embeddings, ModalityType.AUDIO, len(audio_rows)) if audio_rows else None
+                if visual_emb is None:
+                    return [self._create_empty_features(duration) for duration in durations]
                 
+                # Модальности комбинируются на устройстве модели, на CPU копируется только результат
                 if audio_emb is not None:
-                    combined_emb = (visual_emb + audio_emb) / 2
-                    logger.debug("Комбинирование визуальных и аудио эмбеддингов")
-                else:
-                    combined_emb = visual_emb
-                    logger.debug("Использование только визуальных эмбеддингов")
+                    visual_emb = self._fuse_embeddings(visual_emb, audio_emb, audio_rows)
+                    logger.debug(f"Комбинирование визуальных и аудио эмбеддингов: {len(audio_rows)}/{len(video_paths)}")
+                fused_emb = self._finalize(visual_emb)
             
-            self._cleanup_temp_file(audio_path)
+            combined_emb = out if out is not None else np.empty(fused_emb.shape, dtype=self.EMBEDDING_DTYPE)
+            combined_emb[:] = fused_emb
             
-            return {
-                "embeddings": combined_emb,
-                "start_time": 0.0,
-                "end_time": duration,
-                "transcript": "",
-                "visual_description": self._generate_visual_description(combined_emb)
-            }
+            descriptions = self._generate_visual_descriptions(combined_emb)
+            return [
+                {
+                    "embeddings": combined_emb[row],
+                    "start_time": 0.0,
+                    "end_time": duration,
+                    "transcript": "",
+                    "visual_description": descriptions[row],
+                    "valid": True
+                }
+                for row, duration in enumerate(durations)
+            ]
             
         except Exception as e:
-            logger.exception(f"Ошибка извлечения признаков для {video_path}: {str(e)}")
-            return self._create_empty_features(0.0)
+            logger.exception(f"Ошибка извлечения признаков для {video_paths}: {str(e)}")
+            return [self._create_empty_features(0.0) for _ in video_paths]
+    
+    @staticmethod
+    def _cache_key(video_path: str, sample_size: int = 1 << 20) -> str:
+        # BLAKE2b по первому и последнему мегабайту и размер файла: клипы небольшие,
+        # поэтому обычно хэшируется весь файл
+        with open(video_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            digest = hashlib.blake2b(f.read(sample_size), digest_size=20)
+            if size > 2 * sample_size:
+                f.seek(-sample_size, os.SEEK_END)
+            digest.update(f.read(sample_size))
+        return f"{digest.hexdigest()}_{size}"
     
-    def _extract_safe_embedding(self, embeddings: Dict, modality) -> np.ndarray:
-        # Безопасное извлечение эмбеддингов с проверкой типов
-        # Нормализация размерности до 1024 (обрезка или дополнение нулями)
-        # Преобразование в float32 для совместимости с FAISS
+    def _load_cached_embedding(self, key: str) -> np.ndarray:
+        cache_file = self.cache_dir / f"{key}.npy"
         try:
-            if modality not in embeddings:
-                logger.debug(f"Эмбеддинги для {modality} не найдены")
-                return None
-            
-            emb = embeddings[modality]
-            
-            if isinstance(emb, torch.Tensor):
-                emb_np = emb.cpu().numpy()
-            elif isinstance(emb, list):
-                if len(emb) > 0 and isinstance(emb[0], torch.Tensor):
-                    emb_np = emb[0].cpu().numpy()
-                else:
-                    emb_np = np.array(emb)
-            elif isinstance(emb, np.ndarray):
-                emb_np = emb
-            else:
-                logger.error(f"Неподдерживаемый тип эмбеддинга для {modality}: {type(emb)}")
-                return None
-            
-            if emb_np.ndim > 1:
-                emb_np = emb_np.flatten()
-            
-            if len(emb_np) != 1024:
-                if len(emb_np) > 1024:
-                    emb_np = emb_np[:1024]
-                else:
-                    padded = np.zeros(1024)
-                    padded[:len(emb_np)] = emb_np
-                    emb_np = padded
-            
-            logger.debug(f"Форма эмбеддинга {modality}: {emb_np.shape}")
-            return emb_np.astype(np.float32)
-            
+            embedding = np.load(cache_file)
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            logger.error(f"Ошибка извлечения эмбеддинга {modality}: {e}")
+            logger.warning(f"Поврежденная запись кэша эмбеддингов {cache_file}: {e}")
             return None
+        return embedding if embedding.shape == (self.EMB_DIM,) else None
+    
+    def _save_cached_embedding(self, key: str, embedding: np.ndarray) -> None:
+        # Запись через временный файл и переименование: параллельные потоки и прерванная
+        # запись не оставляют в кэше неполных файлов
+        cache_file = self.cache_dir / f"{key}.npy"
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_file, 'wb') as f:
+                np.save(f, np.asarray(embedding, dtype=self.EMBEDDING_DTYPE))
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.warning(f"Ошибка записи кэша эмбеддингов {cache_file}: {e}")
+            tmp_file.unlink(missing_ok=True)
+    
+    def _to_device(self, tensor: torch.Tensor) -> torch.Tensor:
+        if self._pin_memory:
+            return tensor.pin_memory().to(self.device, non_blocking=True)
+        return tensor.to(self.device)
+    
+    def _autocast(self):
+        if self._autocast_dtype is None:
+            return contextlib.nullcontext()
+        # Кэш приведенных весов autocast несовместим с записью CUDA-графов
+        return torch.autocast(device_type="cuda", dtype=self._autocast_dtype,
+                              cache_enabled=not self._use_cuda_graphs)
+    
+    def _fit_embeddings(self, embeddings: Dict) -> Dict:
+        # Контракт ImageBind - тензор (B, D) на модальность. Приведение к (B, EMB_DIM) float32
+        # (обрезка или дополнение нулями) выполняется на устройстве модели, до копирования на CPU
+        fitted = {}
+        for modality, emb in embeddings.items():
+            emb = emb.reshape(emb.shape[0], -1)[:, :self.EMB_DIM].float()
+            if emb.shape[1] < self.EMB_DIM:
+                emb = F.pad(emb, (0, self.EMB_DIM - emb.shape[1]))
+            fitted[modality] = emb
+        return fitted
+    
+    def _fuse_embeddings(self, visual_emb: torch.Tensor, audio_emb: torch.Tensor, audio_rows: List[int]) -> torch.Tensor:
+        # Среднее визуального и аудио эмбеддинга (lerp с весом 0.5) в float32 на месте, без
+        # временных тензоров; если аудио есть у всех клипов, строки не выбираются по индексу
+        if len(audio_rows) == visual_emb.shape[0]:
+            return visual_emb.lerp_(audio_emb, 0.5)
+        rows = torch.as_tensor(audio_rows, device=visual_emb.device)
+        return visual_emb.index_copy_(0, rows, visual_emb.index_select(0, rows).lerp_(audio_emb, 0.5))
+    
+    def _finalize(self, embeddings: torch.Tensor) -> np.ndarray:
+        # Итоговые эмбеддинги приводятся к FP16 (EMBEDDING_DTYPE) на устройстве, что вдвое
+        # сокращает копируемые данные; с GPU - одно асинхронное копирование в закрепленную
+        # память (блоки переиспользует кэширующий аллокатор PyTorch) и одна синхронизация на пакет
+        embeddings = embeddings.to(torch.float16)
+        if not (self._pin_memory and embeddings.is_cuda):
+            return embeddings.numpy()
+        host = torch.empty(embeddings.shape, dtype=embeddings.dtype, pin_memory=True)
+        host.copy_(embeddings, non_blocking=True)
+        torch.cuda.current_stream().synchronize()
+        return host.numpy()
+    
+    def _extract_safe_embeddings(self, embeddings: Dict, modality, rows: int) -> torch.Tensor:
+        # Эмбеддинги модальности как тензор float32 (rows, EMB_DIM) на устройстве модели: форма
+        # и тип уже приведены в _fit_embeddings (единый тензорный контракт), здесь только
+        # проверка числа строк
+        emb = embeddings.get(modality)
+        if emb is None:
+            logger.debug(f"Эмбеддинги для {modality} не найдены")
+            return None
+        
+        if emb.shape[0] != rows:
+            logger.error(f"Неверное число эмбеддингов {modality}: {emb.shape[0]}, ожидалось {rows}")
+            return None
+        
+        return emb
     
     def _get_video_duration(self, video_path: str) -> float:
         try:
-            with av.open(video_path) as container:
-                video_stream = next(s for s in container.streams if s.type == 'video')
-                return float(video_stream.duration * video_stream.time_base)
+            stat = os.stat(video_path)
+            return _probe_duration(video_path, stat.st_mtime_ns, stat.st_size)
         except Exception as e:
             logger.error(f"Ошибка получения длительности видео: {e}")
             return 0.0
     
-    def _has_audio(self, video_path: str) -> bool:
+    @staticmethod
+    def _container_duration(container) -> float:
+        return _container_duration(container)
+    
+    def _load_clip_audio(self, video_path: str, device: str) -> Tuple[float, torch.Tensor]:
+        # Длительность клипа и аудио для ImageBind за одно открытие контейнера:
+        # декодирование в памяти через PyAV, при ошибке - через FFmpeg с выводом в pipe.
+        # Аудио None - в клипе его нет или его не удалось загрузить
+        duration = 0.0
         try:
             with av.open(video_path) as container:
-                return any(s.type == 'audio' for s in container.streams)
-        except Exception:
-            return False
+                duration = self._container_duration(container)
+                if not container.streams.audio:
+                    return duration, None
+                waveform = self._decode_audio(container)
+            if waveform is None:
+                return duration, None
+            return duration, self._transform_audio(torch.from_numpy(waveform).unsqueeze(0), device)
+        except Exception as e:
+            logger.debug(f"Декодирование аудио через PyAV не удалось, используется FFmpeg: {e}")
+        
+        waveform = self._extract_audio(video_path)
+        if waveform is None:
+            return duration, None
+        try:
+            return duration, self._transform_audio(torch.from_numpy(waveform.copy()).unsqueeze(0), device)
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки аудио данных: {e}")
+            return duration, None
     
-    def _extract_audio(self, video_path: str) -> str:
+    def _load_video_inputs(self, video_paths: List[str]) -> torch.Tensor:
+        # Видео пакета для ImageBind на CPU: через torchcodec, если он установлен,
+        # иначе (или при ошибке) - загрузчиком ImageBind
+        if VideoDecoder is not None:
+            try:
+                return torch.stack([self._decode_video(path) for path in video_paths], dim=0)
+            except Exception as e:
+                logger.debug(f"Декодирование видео через torchcodec не удалось: {e}")
+        return data.load_and_transform_video_data(video_paths, "cpu")
+    
+    def _decode_video(self, video_path: str) -> torch.Tensor:
+        # Повторяет data.load_and_transform_video_data для одного клипа: 5 клипов по 2 секунды,
+        # по 2 кадра на клип, масштаб 224 по короткой стороне, нормализация и 3 кропа
+        decoder = VideoDecoder(video_path)
+        duration = decoder.metadata.duration_seconds
+        clip_sampler = ConstantClipsPerVideoSampler(clip_duration=2, clips_per_video=5)
+        frame_sampler = pv_transforms.UniformTemporalSubsample(num_samples=2)
+        video_transform = transforms.Compose([
+            pv_transforms.ShortSideScale(224),
+            NormalizeVideo(mean=(0.48145466, 0.4578275, 0.40821073), std=(0.26862954, 0.26130258, 0.27577711)),
+        ])
+        
+        all_video = []
+        for clip_timepoints in data.get_clip_timepoints(clip_sampler, duration):
+            start, end = float(clip_timepoints[0]), min(float(clip_timepoints[1]), duration)
+            # Кадры (T, C, H, W) uint8 -> (C, T, H, W), как у EncodedVideo.get_clip
+            frames = decoder.get_frames_played_in_range(start, end).data.permute(1, 0, 2, 3)
+            video_clip = frame_sampler(frames.float()) / 255.0
+            all_video.append(video_transform(video_clip))
+        
+        all_video = data.SpatialCrop(224, num_crops=3)(all_video)
+        return torch.stack(all_video, dim=0)
+    
+    def _decode_audio(self, container) -> np.ndarray:
+        # Моно float32 с частотой AUDIO_SAMPLE_RATE из открытого контейнера
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=self.AUDIO_SAMPLE_RATE)
+        chunks = []
+        for frame in container.decode(audio=0):
+            chunks.extend(self._resampled(resampler, frame))
+        # Сброс остатка ресемплера
+        chunks.extend(self._resampled(resampler, None))
+        
+        if not chunks:
+            return None
+        return np.ascontiguousarray(np.concatenate(chunks, axis=1)[0], dtype=np.float32)
+    
+    @staticmethod
+    def _resampled(resampler, frame) -> List[np.ndarray]:
+        # PyAV до 9.0 возвращает один кадр, новые версии - список кадров
+        frames = resampler.resample(frame)
+        if frames is None:
+            return []
+        if not isinstance(frames, list):
+            frames = [frames]
+        return [f.to_ndarray().reshape(1, -1) for f in frames]
+    
+    def _transform_audio(self, waveform: torch.Tensor, device: str) -> torch.Tensor:
+        # Повторяет data.load_and_transform_audio_data для сигнала в памяти:
+        # клипы по 2 секунды -> мел-спектрограммы -> нормализация
+        sample_rate = self.AUDIO_SAMPLE_RATE
+        clip_sampler = ConstantClipsPerVideoSampler(clip_duration=2, clips_per_video=3)
+        all_clips_timepoints = data.get_clip_timepoints(clip_sampler, waveform.size(1) / sample_rate)
+        normalize = transforms.Normalize(mean=-4.268, std=9.138)
+        
+        all_clips = []
+        for clip_timepoints in all_clips_timepoints:
+            waveform_clip = waveform[:, int(clip_timepoints[0] * sample_rate):int(clip_timepoints[1] * sample_rate)]
+            waveform_melspec = data.waveform2melspec(waveform_clip, sample_rate, 128, 204)
+            all_clips.append(normalize(waveform_melspec).to(device))
+        return torch.stack(all_clips, dim=0)
+    
+    def _extract_audio(self, video_path: str) -> np.ndarray:
+        # FFmpeg отдает аудио сырым моно float32 16 кГц в stdout: без временного файла на диске
         try:
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpfile:
-                audio_path = tmpfile.name
-            
             cmd = [
-                'ffmpeg', '-y', '-i', video_path,
-                '-ac', '1', '-ar', '16000',
-                '-loglevel', 'error', audio_path
+                *FFMPEG_CMD, '-i', video_path,
+                '-vn', '-ac', '1', '-ar', str(self.AUDIO_SAMPLE_RATE),
+                '-f', 'f32le', 'pipe:1'
             ]
-            result = subprocess.run(cmd, capture_output=True)
+            result = subprocess.run(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL, close_fds=False
+            )
             
-            if result.returncode == 0:
-                logger.debug(f"Аудио извлечено в: {audio_path}")
-                return audio_path
+            if result.returncode == 0 and result.stdout:
+                logger.debug(f"Аудио извлечено через FFmpeg: {video_path}")
+                return np.frombuffer(result.stdout, dtype='<f4').astype(np.float32, copy=False)
             else:
                 logger.error(f"Ошибка FFmpeg: {result.stderr.decode()}")
                 return None
@@ -166,41 +587,31 @@ class MultimodalExtractor:
             logger.error(f"Ошибка извлечения аудио: {e}")
             return None
     
-    def _cleanup_temp_file(self, file_path: str):
-        if file_path and Path(file_path).exists():
-            try:
-                Path(file_path).unlink()
-                logger.debug("Временный аудио файл удален")
-            except Exception as e:
-                logger.warning(f"Ошибка удаления временного файла: {e}")
-    
     def _create_empty_features(self, duration: float) -> Dict[str, Any]:
         return {
-            "embeddings": np.zeros(1024, dtype=np.float32),
+            "embeddings": self.EMPTY_EMBEDDING,
             "start_time": 0.0,
             "end_time": duration,
             "transcript": "",
-            "visual_description": "Ошибка обработки"
+            "visual_description": "Ошибка обработки",
+            "valid": False
         }
     
     def _generate_visual_description(self, visual_emb: np.ndarray) -> str:
+        if visual_emb is None or len(visual_emb) == 0:
+            return "Визуальные признаки отсутствуют"
+        return self._generate_visual_descriptions(visual_emb.reshape(1, -1))[0]
+    
+    def _generate_visual_descriptions(self, visual_embs: np.ndarray) -> List[str]:
+        # Категория по доминирующему признаку: один argmax на строку пакета
+        # и векторный поиск диапазона вместо сортировки каждого эмбеддинга
         try:
-            if visual_emb is None or len(visual_emb) == 0:
-                return "Визуальные признаки отсутствуют"
-            
-            top_indices = np.argsort(np.abs(visual_emb))[-5:]
-            dominant_feature = top_indices[-1]
-            
-            if dominant_feature < 256:
-                category = "Сцена/Фон"
-            elif dominant_feature < 512:
-                category = "Объекты/Люди"
-            elif dominant_feature < 768:
-                category = "Движение/Действие"
-            else:
-                category = "Визуальные эффекты"
-            
-            return f"{category} (признак #{dominant_feature})"
+            dominant_features = np.abs(visual_embs).argmax(axis=1)
+            categories = np.searchsorted(self.FEATURE_BINS, dominant_features, side='right')
+            return [
+                f"{self.FEATURE_CATEGORIES[category]} (признак #{dominant_feature})"
+                for category, dominant_feature in zip(categories.tolist(), dominant_features.tolist())
+            ]
         except Exception as e:
             logger.error(f"Ошибка генерации описания: {e}")
-            return "Описание недоступно"
\ No newline at end of file
+            return ["Описание недоступно"] * len(visual_embs)
@@ -1,8 +1,11 @@
 from typing import List, Dict, Any
 import numpy as np
 import torch
+import torch.nn.functional as F
 from imagebind.models.imagebind_model import ModalityType
 from imagebind import data
+from imagebind.models.multimodal_preprocessors import SimpleTokenizer
+from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,70 +16,57 @@ class Retriever:
     '''
     def __init__(self, vector_store):
         self.vector_store = vector_store
+        # data.load_and_transform_text создает токенизатор (чтение BPE-словаря) на каждый запрос:
+        # токенизатор создается один раз, а токены повторяющихся запросов кэшируются
+        bpe_path = data.return_bpe_path() if hasattr(data, "return_bpe_path") else data.BPE_PATH
+        self._tokenizer = SimpleTokenizer(bpe_path=bpe_path)
+        self._tokenize = lru_cache(maxsize=1024)(self._tokenize_uncached)
+    
+    def _tokenize_uncached(self, query: str, device) -> torch.Tensor:
+        return self._tokenizer(query).unsqueeze(0).to(device)
         
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        # 1. Преобразует текстовый запрос в эмбеддинг через ImageBind
-        # 2. Обрабатывает эмбеддинг для совместимости с векторным хранилищем
-        # 3. Выполняет поиск в векторном хранилище
-        # 4. Возвращает ранжированные результаты
+    def search(self, query: str, top_k: int = 5, nprobe: int = None) -> List[Dict[str, Any]]:
+        results = self.search_batch([query], top_k, nprobe=nprobe)
+        return results[0] if results else []
+    
+    def search_batch(self, queries: List[str], top_k: int = 5, nprobe: int = None) -> List[List[Dict[str, Any]]]:
+        # 1. Преобразует текстовые запросы в эмбеддинги через ImageBind одним проходом модели
+        # 2. Обрабатывает эмбеддинги для совместимости с векторным хранилищем
+        # 3. Выполняет поиск в векторном хранилище одним вызовом FAISS
+        #    (nprobe - точность/скорость для IVF-индекса)
+        # 4. Возвращает ранжированные результаты для каждого запроса
         try:
-            logger.info(f"Выполнение поиска по запросу: {query}")
+            logger.info(f"Выполнение поиска по запросам: {queries}")
             
-            # Подготовка текстовых данных для ImageBind
-            with torch.no_grad():
-                text_input = data.load_and_transform_text([query], self.vector_store.model.device)
+            # Подготовка текстовых данных для ImageBind: токены (B, 77)
+            with torch.inference_mode():
+                device = self.vector_store.model.device
+                text_input = torch.cat([self._tokenize(query, device) for query in queries], dim=0)
                 inputs = {ModalityType.TEXT: text_input}
                 
                 embeddings = self.vector_store.model(inputs)
                 
-                if ModalityType.TEXT in embeddings:
-                    query_embedding = embeddings[ModalityType.TEXT]
-                else:
+                if ModalityType.TEXT not in embeddings:
                     logger.error("Текстовые эмбеддинги не найдены в выходных данных модели")
                     return []
+                
+                query_embeddings = self._process_embedding(embeddings[ModalityType.TEXT])
             
-            query_embedding = self._process_embedding(query_embedding)
-            
-            if query_embedding is None:
-                logger.error("Ошибка обработки эмбеддинга запроса")
-                return []
-            
-            logger.debug(f"Форма эмбеддинга запроса: {query_embedding.shape}")
-            logger.debug(f"Тип эмбеддинга запроса: {type(query_embedding)}")
+            logger.debug(f"Форма эмбеддингов запросов: {query_embeddings.shape}")
             
-            results = self.vector_store.search(query_embedding, top_k)
+            results = self.vector_store.search_batch(query_embeddings, top_k, nprobe=nprobe, normalized=True)
             
-            logger.info(f"Найдено результатов: {len(results)}")
+            logger.info(f"Найдено результатов: {[len(query_results) for query_results in results]}")
             return results
             
         except Exception as e:
             logger.exception(f"Ошибка поиска: {str(e)}")
             return []
     
-    def _process_embedding(self, embedding) -> np.ndarray:
-        try:
-            if isinstance(embedding, torch.Tensor):
-                embedding_np = embedding.cpu().numpy()
-            elif isinstance(embedding, list):
-                if len(embedding) > 0 and isinstance(embedding[0], torch.Tensor):
-                    embedding_np = embedding[0].cpu().numpy()
-                else:
-                    embedding_np = np.array(embedding)
-            elif isinstance(embedding, np.ndarray):
-                embedding_np = embedding
-            else:
-                logger.error(f"Неподдерживаемый тип эмбеддинга: {type(embedding)}")
-                return None
-            
-            if embedding_np.ndim == 1:
-                embedding_np = embedding_np.reshape(1, -1)
-            elif embedding_np.ndim > 2:
-                embedding_np = embedding_np.reshape(embedding_np.shape[0], -1)
-            
-            embedding_np = embedding_np.astype(np.float32)
-            
-            return embedding_np
-            
-        except Exception as e:
-            logger.error(f"Ошибка обработки эмбеддинга: {e}")
-            return None
\ No newline at end of file
+    def _process_embedding(self, embedding: torch.Tensor) -> np.ndarray:
+        # Контракт ImageBind - тензор (N, D) на модальность: без проверок типа и перехвата ошибок
+        # на каждый запрос (исключения обрабатывает search_batch).
+        # Форма, float32 и L2-нормализация выполняются на устройстве модели,
+        # на CPU копируется только готовый вектор для FAISS
+        embedding = embedding.reshape(embedding.shape[0], -1).float()
+        return F.normalize(embedding, dim=1).cpu().numpy()
@@ -0,0 +1,69 @@
+import threading
+import logging
+
+import torch
+from imagebind.models import imagebind_model
+from imagebind.models.imagebind_model import ModalityType
+
+try:
+    import bitsandbytes as bnb
+except ImportError:
+    bnb = None
+
+logger = logging.getLogger(__name__)
+
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+def get_imagebind(device: str = "cpu", quantization: str = None) -> torch.nn.Module:
+    """Модель ImageBind, загружаемая один раз на процесс для пары (устройство, квантование).
+
+    quantization: None - FP32, "dynamic" - int8 для CPU, "bnb" - int8 bitsandbytes для CUDA
+    """
+    key = (str(device), quantization)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = imagebind_model.imagebind_huge(pretrained=True)
+            model.eval().to(device)
+            if quantization == "bnb":
+                replaced = sum(
+                    _replace_linear_8bit(model.modality_trunks[modality], device)
+                    for modality in (ModalityType.VISION, ModalityType.AUDIO, ModalityType.TEXT)
+                )
+                logger.info(f"Слои Linear ImageBind переведены в int8 (bitsandbytes): {replaced}")
+            elif quantization == "dynamic":
+                # Веса Linear хранятся в int8 (вчетверо меньше памяти), матричные умножения
+                # выполняются int8-ядрами CPU. Проекции внутри nn.MultiheadAttention PyTorch
+                # намеренно не квантует динамически, поэтому в наборе только Linear.
+                # inplace=True: без копии FP32-модели рядом с квантованной
+                torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+                logger.info("Модель ImageBind квантована в int8")
+            model.device = device
+            if str(device).startswith("cuda"):
+                # Освобождает кэш аллокатора после промежуточных буферов загрузки весов
+                torch.cuda.empty_cache()
+            _MODELS[key] = model
+            logger.info(f"Модель ImageBind загружена на устройство: {device}")
+    return model
+
+def _replace_linear_8bit(module: torch.nn.Module, device: str) -> int:
+    # Linear8bitLt хранит веса в int8 и умножает на int8-ядрах GPU; LayerNorm и softmax
+    # остаются в исходной точности. Проекции nn.MultiheadAttention (out_proj - подкласс Linear)
+    # не заменяются: модуль обращается к их весам напрямую
+    replaced = 0
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            linear = bnb.nn.Linear8bitLt(
+                child.in_features, child.out_features, bias=child.bias is not None,
+                has_fp16_weights=False, threshold=6.0
+            )
+            linear.weight = bnb.nn.Int8Params(child.weight.data.cpu(), requires_grad=False, has_fp16_weights=False)
+            if child.bias is not None:
+                linear.bias = torch.nn.Parameter(child.bias.data, requires_grad=False)
+            # Перенос на GPU квантует веса
+            setattr(module, name, linear.to(device))
+            replaced += 1
+        else:
+            replaced += _replace_linear_8bit(child, device)
+    return replaced
@@ -0,0 +1,22 @@
+import atexit
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool(max_workers: int = None) -> ThreadPoolExecutor:
+    """Общий пул потоков, создаваемый при первом обращении и живущий до завершения процесса"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            workers = max_workers or Config.MAX_WORKERS
+            _POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-rag")
+            atexit.register(_POOL.shutdown)
+            logger.debug(f"Создан общий пул потоков: {workers} workers")
+    return _POOL
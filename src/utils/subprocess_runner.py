@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+from functools import lru_cache
+from typing import List, Sequence, Tuple, Union
+
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+# Общий префикс команд FFmpeg: без опроса stdin, баннера и информационного вывода в stderr.
+# Процесс FFmpeg не принимает новые задания после запуска, поэтому вместо пула долгоживущих
+# процессов сокращается работа, которую выполняет каждый запуск
+FFMPEG_CMD = ('ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y')
+
+@lru_cache(maxsize=1)
+def warm_ffmpeg() -> None:
+    """Подгружает бинарник FFmpeg и его библиотеки в page cache до первых запусков"""
+    binary = shutil.which('ffmpeg')
+    if not binary:
+        logger.warning("FFmpeg не найден в PATH")
+        return
+    
+    files = [binary]
+    if hasattr(os, 'posix_fadvise') and shutil.which('ldd'):
+        try:
+            # Строки ldd: "libavcodec.so.59 => /usr/lib/.../libavcodec.so.59 (0x...)"
+            ldd = subprocess.run(
+                ['ldd', binary], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL, text=True, timeout=10, close_fds=False
+            )
+            files += [
+                parts[2] for parts in (line.split() for line in ldd.stdout.splitlines())
+                if len(parts) >= 3 and parts[1] == '=>' and parts[2].startswith('/')
+            ]
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.debug(f"Не удалось получить библиотеки FFmpeg: {e}")
+    
+    if hasattr(os, 'posix_fadvise'):
+        for path in files:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                continue
+    
+    # Холостой запуск заодно прогревает динамический загрузчик
+    try:
+        subprocess.run(
+            [binary, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL, timeout=10, close_fds=False
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.debug(f"Ошибка прогревочного запуска FFmpeg: {e}")
+    
+    logger.debug(f"FFmpeg прогрет: файлов в page cache {len(files)}")
+
+class AsyncSubprocessRunner:
+    '''
+    Класс AsyncSubprocessRunner запускает внешние процессы (FFmpeg) через asyncio в одном event loop:
+    stderr всех процессов читается одним циклом событий вместо отдельного потока на каждый процесс.
+    '''
+    def __init__(self, max_concurrency: int = None):
+        self.max_concurrency = max_concurrency or Config.MAX_WORKERS
+
+    async def spawn(self, cmd: Sequence[str], stdout=asyncio.subprocess.DEVNULL) -> asyncio.subprocess.Process:
+        # stdout по умолчанию не нужен: FFmpeg пишет результат в файлы, а диагностику - в stderr.
+        # close_fds=False безопасен: дескрипторы Python по умолчанию не наследуются (PEP 446),
+        # а обход всех открытых fd при каждом fork не нужен
+        return await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=stdout, stderr=asyncio.subprocess.PIPE,
+            close_fds=False
+        )
+
+    async def run_one(self, cmd: Sequence[str], timeout: float = None) -> Tuple[int, str]:
+        process = await self.spawn(cmd)
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(list(cmd), timeout)
+        return process.returncode, stderr.decode(errors='replace')
+
+    async def run_all(self, cmds: Sequence[Sequence[str]],
+                      timeout: float = None) -> List[Union[Tuple[int, str], Exception]]:
+        # Результаты возвращаются в порядке команд; ошибка одной команды не прерывает остальные
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_limited(cmd):
+            async with semaphore:
+                return await self.run_one(cmd, timeout)
+
+        return await asyncio.gather(*(run_limited(cmd) for cmd in cmds), return_exceptions=True)
+
+    def run(self, cmds: Sequence[Sequence[str]],
+            timeout: float = None) -> List[Union[Tuple[int, str], Exception]]:
+        # Синхронная обертка для вызова вне event loop
+        if not cmds:
+            return []
+        return asyncio.run(self.run_all(cmds, timeout))